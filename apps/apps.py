@@ -5,6 +5,9 @@ class AppConfig4Editors(AppConfig):
     name = 'apps.editors'
     label = 'editors'
 
+    def ready(self):
+        from .editors import signals  # noqa
+
 
 class AppConfig4Executors(AppConfig):
     name = 'apps.executors'
@@ -0,0 +1,311 @@
+import json
+
+from django.db import (
+    IntegrityError,
+    transaction,
+)
+from rest_framework import exceptions
+
+from .models import (
+    Procedure,
+    ProcedureInput,
+    ProcedureJoint,
+    ProcedureJointLink,
+    ProcedureOutput,
+    ProcedureOutputLink,
+    ProcedureSite,
+    ProcedureSiteRelationship,
+    readable_sites,
+)
+from .validators import find_cyclic_joints
+
+archive_version = 1
+
+
+def export_procedures(procedure_ids):
+    """
+    :return: archive records of procedures, rows of each model are read
+        by one query of plain values
+    """
+    records = dict(
+        (i, {
+            'signature': signature,
+            'docstring': docstring,
+            'editable': editable,
+            'inputs': [],
+            'outputs': [],
+            'joints': [],
+        }) for i, signature, docstring, editable in
+        Procedure.objects.filter(id__in=procedure_ids).values_list(
+            'id', 'signature', 'docstring', 'editable')
+    )
+
+    for procedure_id, signature, index in ProcedureInput.objects.filter(
+            procedure_id__in=procedure_ids,
+    ).order_by('index').values_list('procedure_id', 'signature', 'index'):
+        records[procedure_id]['inputs'].append({
+            'signature': signature,
+            'index': index,
+        })
+
+    for procedure_id, signature, index, joint, joint_index in \
+            ProcedureOutput.objects.filter(
+                procedure_id__in=procedure_ids,
+            ).order_by('index').values_list(
+                'procedure_id',
+                'signature',
+                'index',
+                'output_link__output_joint__signature',
+                'output_link__output_index',
+            ):
+        records[procedure_id]['outputs'].append({
+            'signature': signature,
+            'index': index,
+            'link': None if joint_index is None else {
+                'output_joint': joint,
+                'output_index': joint_index,
+            },
+        })
+
+    joints = {}
+    for i, procedure_id, signature, site, procedure in \
+            ProcedureJoint.objects.filter(
+                outer_procedure_id__in=procedure_ids,
+            ).order_by('id').values_list(
+                'id',
+                'outer_procedure_id',
+                'signature',
+                'inner_procedure__site__signature',
+                'inner_procedure__signature',
+            ):
+        joints[i] = {
+            'signature': signature,
+            'site': site,
+            'procedure': procedure,
+            'links': [],
+        }
+        records[procedure_id]['joints'].append(joints[i])
+
+    for joint_id, index, input_joint, input_index in \
+            ProcedureJointLink.objects.filter(
+                joint_id__in=joints.keys(),
+            ).order_by('index').values_list(
+                'joint_id',
+                'index',
+                'input_joint__signature',
+                'input_index',
+            ):
+        joints[joint_id]['links'].append({
+            'index': index,
+            'input_joint': input_joint,
+            'input_index': input_index,
+        })
+
+    return [records[i] for i in procedure_ids]
+
+
+def export_site(site, chunk_size=500):
+    """
+    iterate ndjson lines of site archive, a header of site and signatures
+    of its base sites followed by one line per procedure with its graph
+    """
+    yield json.dumps({
+        'version': archive_version,
+        'signature': site.signature,
+        'base_sites': list(site.base_sites.order_by(
+            'signature',
+        ).values_list('signature', flat=True)),
+    }) + '\n'
+
+    last_id = 0
+    while True:
+        procedure_ids = list(site.procedures.filter(
+            id__gt=last_id,
+        ).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not procedure_ids:
+            return
+
+        for record in export_procedures(procedure_ids):
+            yield json.dumps(record) + '\n'
+        last_id = procedure_ids[-1]
+
+
+def iterate_chunks(records, chunk_size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_site(user, lines, chunk_size=500):
+    """
+    create site of archive with all its procedures for user, base sites
+    should exist already, either as sites of user or as shared sites.
+    archive is parsed line by line as procedures are created by chunks,
+    so that only one chunk of records is held in memory
+
+    :param lines: ndjson lines of archive
+    """
+    records = (json.loads(line) for line in lines if line.strip())
+    try:
+        header = next(records, None)
+        if not isinstance(header, dict) or \
+                header.get('version') != archive_version:
+            raise exceptions.ValidationError('invalid archive version')
+
+        with transaction.atomic():
+            site = create_site(user, header)
+            base_site_ids = list(site.base_sites.values_list('id', flat=True))
+            for chunk in iterate_chunks(records, chunk_size):
+                create_procedures(site, base_site_ids, chunk)
+            return site
+
+    except (AttributeError, KeyError, TypeError, ValueError):
+        raise exceptions.ValidationError('invalid archive')
+    except IntegrityError as e:
+        raise exceptions.ValidationError(str(e))
+
+
+def create_site(user, header):
+    if ProcedureSite.objects.filter(
+            readable_sites(user.uuid),
+            signature=header['signature'],
+    ).exists():
+        raise exceptions.ValidationError('site already exists')
+
+    base_sites = dict(ProcedureSite.objects.filter(
+        readable_sites(user.uuid),
+        signature__in=header['base_sites'],
+    ).values_list('signature', 'id'))
+    if set(header['base_sites']) - set(base_sites):
+        raise exceptions.ValidationError('invalid base site')
+
+    site = ProcedureSite.objects.create(
+        user=user,
+        signature=header['signature'],
+    )
+    ProcedureSiteRelationship.objects.bulk_create([
+        ProcedureSiteRelationship(sub=site, base_id=i)
+        for i in base_sites.values()
+    ])
+    return site
+
+
+def create_procedures(site, base_site_ids, procedures):
+    """
+    bulk create rows of each model of procedures in dependency order, ids
+    of rows are queried back by their natural keys for bulk_create does
+    not return them on every database
+    """
+    Procedure.objects.bulk_create([
+        Procedure(
+            site=site,
+            signature=p['signature'],
+            docstring=p.get('docstring', ''),
+            editable=p.get('editable', True),
+        ) for p in procedures
+    ])
+    procedure_ids = dict(site.procedures.filter(
+        signature__in=[p['signature'] for p in procedures],
+    ).values_list('signature', 'id'))
+
+    inputs = []
+    outputs = []
+    for p in procedures:
+        procedure_id = procedure_ids[p['signature']]
+        inputs.extend(ProcedureInput(
+            procedure_id=procedure_id,
+            signature=i['signature'],
+            index=i['index'],
+        ) for i in p['inputs'])
+        outputs.extend(ProcedureOutput(
+            procedure_id=procedure_id,
+            signature=o['signature'],
+            index=o['index'],
+        ) for o in p['outputs'])
+    ProcedureInput.objects.bulk_create(inputs)
+    ProcedureOutput.objects.bulk_create(outputs)
+    output_ids = dict(
+        ((procedure_id, index), i) for procedure_id, index, i in
+        ProcedureOutput.objects.filter(
+            procedure_id__in=procedure_ids.values(),
+        ).values_list('procedure_id', 'index', 'id')
+    )
+
+    inner_procedure_ids = dict(
+        ((site_signature, signature), i) for site_signature, signature, i in
+        Procedure.objects.filter(
+            site_id__in=base_site_ids,
+            signature__in=set(
+                j['procedure'] for p in procedures for j in p['joints']),
+        ).values_list('site__signature', 'signature', 'id')
+    )
+    joints = []
+    for p in procedures:
+        if find_cyclic_joints(dict((j['signature'], [
+            link.get('input_joint') for link in j['links']
+        ]) for j in p['joints'])):
+            raise exceptions.ValidationError('cyclic joint links')
+
+        for j in p['joints']:
+            inner_procedure_id = inner_procedure_ids.get(
+                (j['site'], j['procedure']))
+            if inner_procedure_id is None:
+                raise exceptions.ValidationError('invalid procedure')
+
+            joints.append(ProcedureJoint(
+                outer_procedure_id=procedure_ids[p['signature']],
+                inner_procedure_id=inner_procedure_id,
+                signature=j['signature'],
+            ))
+    ProcedureJoint.objects.bulk_create(joints)
+    joint_ids = dict(
+        ((procedure_id, signature), i) for procedure_id, signature, i in
+        ProcedureJoint.objects.filter(
+            outer_procedure_id__in=procedure_ids.values(),
+        ).values_list('outer_procedure_id', 'signature', 'id')
+    )
+
+    def get_joint_id(procedure_id, signature, message):
+        if signature is None:
+            return None
+        joint_id = joint_ids.get((procedure_id, signature))
+        if joint_id is None:
+            raise exceptions.ValidationError(message)
+        return joint_id
+
+    links = []
+    output_links = []
+    for p in procedures:
+        procedure_id = procedure_ids[p['signature']]
+        for j in p['joints']:
+            links.extend(ProcedureJointLink(
+                joint_id=joint_ids[(procedure_id, j['signature'])],
+                index=link['index'],
+                input_joint_id=get_joint_id(
+                    procedure_id,
+                    link.get('input_joint'),
+                    'invalid input joint',
+                ),
+                input_index=link['input_index'],
+            ) for link in j['links'])
+
+        for o in p['outputs']:
+            link = o.get('link')
+            if not link:
+                continue
+            output_links.append(ProcedureOutputLink(
+                output_id=output_ids[(procedure_id, o['index'])],
+                output_joint_id=get_joint_id(
+                    procedure_id,
+                    link.get('output_joint'),
+                    'invalid output joint',
+                ),
+                output_index=link['output_index'],
+            ))
+    ProcedureJointLink.objects.bulk_create(links)
+    ProcedureOutputLink.objects.bulk_create(output_links)
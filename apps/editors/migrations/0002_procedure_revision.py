@@ -0,0 +1,19 @@
+# Generated by Django 2.2.8 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('editors', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='procedure',
+            name='revision',
+            field=models.PositiveIntegerField(
+                default=0
+            ),
+        ),
+    ]
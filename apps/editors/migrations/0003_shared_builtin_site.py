@@ -0,0 +1,145 @@
+# Generated by Django 2.2.8 on 2026-10-18 16:02
+
+from django.db import migrations
+
+
+def get_user_site_signature(site_model, user_id, signature):
+    taken = set(site_model.objects.filter(
+        user_id=user_id,
+        signature__startswith=signature,
+    ).values_list('signature', flat=True))
+    if signature not in taken:
+        return signature
+
+    index = 2
+    while '{}-{}'.format(signature, index) in taken:
+        index += 1
+    return '{}-{}'.format(signature, index)
+
+
+def share_builtin_sites(apps, schema_editor):
+    """
+    merge builtin procedures copied into builtin sites of users into one
+    shared site, joints, base site relationships and runs referring to
+    copies are pointed to the shared procedures before copies are deleted
+
+    procedures authored by users in their builtin sites are kept, their
+    sites are renamed to builtin-user and based on the shared site
+    """
+    site_model = apps.get_model('editors', 'ProcedureSite')
+    relationship_model = apps.get_model(
+        'editors', 'ProcedureSiteRelationship')
+    procedure_model = apps.get_model('editors', 'Procedure')
+    input_model = apps.get_model('editors', 'ProcedureInput')
+    output_model = apps.get_model('editors', 'ProcedureOutput')
+    joint_model = apps.get_model('editors', 'ProcedureJoint')
+    run_model = apps.get_model('executors', 'ProcedureRun')
+
+    site_ids = list(site_model.objects.filter(
+        signature='builtin',
+        user__isnull=False,
+    ).values_list('id', flat=True))
+    if not site_ids:
+        return
+
+    shared_site, __ = site_model.objects.get_or_create(
+        signature='builtin',
+        user=None,
+    )
+    shared_ids = dict(procedure_model.objects.filter(
+        site=shared_site,
+    ).values_list('signature', 'id'))
+
+    # builtin copies are read-only and have no joints of their own
+    copies = procedure_model.objects.filter(
+        site_id__in=site_ids,
+        editable=False,
+    ).exclude(
+        joints__isnull=False,
+    )
+
+    for procedure in copies.order_by('id'):
+        if procedure.signature in shared_ids:
+            continue
+
+        shared = procedure_model.objects.create(
+            site=shared_site,
+            signature=procedure.signature,
+            docstring=procedure.docstring,
+            editable=False,
+        )
+        input_model.objects.bulk_create([
+            input_model(
+                procedure=shared,
+                signature=i.signature,
+                index=i.index,
+            ) for i in input_model.objects.filter(procedure=procedure)
+        ])
+        output_model.objects.bulk_create([
+            output_model(
+                procedure=shared,
+                signature=o.signature,
+                index=o.index,
+            ) for o in output_model.objects.filter(procedure=procedure)
+        ])
+        shared_ids[procedure.signature] = shared.id
+
+    copy_ids = list(copies.values_list('id', flat=True))
+    for signature, shared_id in shared_ids.items():
+        signature_copy_ids = procedure_model.objects.filter(
+            id__in=copy_ids,
+            signature=signature,
+        ).values('id')
+        joint_model.objects.filter(
+            inner_procedure_id__in=signature_copy_ids,
+        ).update(inner_procedure_id=shared_id)
+        run_model.objects.filter(
+            procedure_id__in=signature_copy_ids,
+        ).update(procedure_id=shared_id)
+
+    input_model.objects.filter(procedure_id__in=copy_ids).delete()
+    output_model.objects.filter(procedure_id__in=copy_ids).delete()
+    procedure_model.objects.filter(id__in=copy_ids).delete()
+
+    kept_ids = set(procedure_model.objects.filter(
+        site_id__in=site_ids,
+    ).values_list('site_id', flat=True))
+
+    # sites based on builtin sites of users are based on the shared site,
+    # and still on the renamed site if it is kept
+    for relationship in relationship_model.objects.filter(
+            base_id__in=site_ids,
+    ):
+        relationship_model.objects.get_or_create(
+            sub_id=relationship.sub_id,
+            base_id=shared_site.id,
+        )
+        if relationship.base_id not in kept_ids:
+            relationship.delete()
+
+    for site in site_model.objects.filter(id__in=kept_ids):
+        site.signature = get_user_site_signature(
+            site_model, site.user_id, 'builtin-user')
+        site.save(update_fields=['signature'])
+        relationship_model.objects.get_or_create(
+            sub_id=site.id,
+            base_id=shared_site.id,
+        )
+
+    removed_ids = [i for i in site_ids if i not in kept_ids]
+    relationship_model.objects.filter(sub_id__in=removed_ids).delete()
+    site_model.objects.filter(id__in=removed_ids).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('editors', '0002_procedure_revision'),
+        ('executors', '0006_procedurerun_profile'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            share_builtin_sites,
+            migrations.RunPython.noop,
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 2.2.8 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+def merge_shared_sites(apps, schema_editor):
+    """
+    merge shared sites of the same signature, left by concurrent
+    initializations, into the oldest one before signatures of shared
+    sites are made unique
+    """
+    site_model = apps.get_model('editors', 'ProcedureSite')
+    relationship_model = apps.get_model(
+        'editors', 'ProcedureSiteRelationship')
+    procedure_model = apps.get_model('editors', 'Procedure')
+    input_model = apps.get_model('editors', 'ProcedureInput')
+    output_model = apps.get_model('editors', 'ProcedureOutput')
+    joint_model = apps.get_model('editors', 'ProcedureJoint')
+    run_model = apps.get_model('executors', 'ProcedureRun')
+
+    signatures = site_model.objects.filter(
+        user__isnull=True,
+    ).values('signature').annotate(
+        count=models.Count('id'),
+    ).filter(count__gt=1).values_list('signature', flat=True)
+
+    for signature in list(signatures):
+        site_ids = list(site_model.objects.filter(
+            signature=signature,
+            user__isnull=True,
+        ).order_by('id').values_list('id', flat=True))
+        kept_id, duplicate_ids = site_ids[0], site_ids[1:]
+
+        # procedures missing from kept site are moved to it, others are
+        # replaced by procedures of kept site
+        kept = dict(procedure_model.objects.filter(
+            site_id=kept_id,
+        ).values_list('signature', 'id'))
+        for procedure_id, procedure_signature in \
+                procedure_model.objects.filter(
+                    site_id__in=duplicate_ids,
+                ).order_by('id').values_list('id', 'signature'):
+            if procedure_signature not in kept:
+                procedure_model.objects.filter(
+                    id=procedure_id,
+                ).update(site_id=kept_id)
+                kept[procedure_signature] = procedure_id
+                continue
+
+            joint_model.objects.filter(
+                inner_procedure_id=procedure_id,
+            ).update(inner_procedure_id=kept[procedure_signature])
+            run_model.objects.filter(
+                procedure_id=procedure_id,
+            ).update(procedure_id=kept[procedure_signature])
+
+        sub_ids = set(relationship_model.objects.filter(
+            base_id=kept_id,
+        ).values_list('sub_id', flat=True))
+        for relationship in relationship_model.objects.filter(
+                base_id__in=duplicate_ids,
+        ):
+            if relationship.sub_id in sub_ids:
+                relationship.delete()
+                continue
+
+            relationship.base_id = kept_id
+            relationship.save(update_fields=['base'])
+            sub_ids.add(relationship.sub_id)
+        relationship_model.objects.filter(sub_id__in=duplicate_ids).delete()
+
+        input_model.objects.filter(
+            procedure__site_id__in=duplicate_ids).delete()
+        output_model.objects.filter(
+            procedure__site_id__in=duplicate_ids).delete()
+        procedure_model.objects.filter(site_id__in=duplicate_ids).delete()
+        site_model.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('editors', '0003_shared_builtin_site'),
+        ('executors', '0006_procedurerun_profile'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_shared_sites,
+            migrations.RunPython.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='proceduresite',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(user=None),
+                fields=('signature',),
+                name='editors_shared_site_signature',
+            ),
+        ),
+    ]
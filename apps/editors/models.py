@@ -24,6 +24,26 @@ class ProcedureSite(models.Model):
         unique_together = [
             ('user', 'signature'),
         ]
+        # null users are distinct to unique_together, shared sites are
+        # made unique by signature alone
+        constraints = [
+            models.UniqueConstraint(
+                fields=['signature'],
+                condition=models.Q(user=None),
+                name='editors_shared_site_signature',
+            ),
+        ]
+
+
+def readable_sites(user_uuid, prefix=''):
+    """
+    :return: filter of rows in sites of user or in shared sites, which
+        have no user and are read-only to everyone
+    """
+    return (
+        models.Q(**{prefix + 'user__uuid': user_uuid}) |
+        models.Q(**{prefix + 'user__isnull': True})
+    )
 
 
 class ProcedureSiteRelationship(models.Model):
@@ -62,6 +82,9 @@ class Procedure(models.Model):
     editable = models.BooleanField(
         default=True,
     )
+    revision = models.PositiveIntegerField(
+        default=0,
+    )
 
     class Meta:
         unique_together = [
@@ -1,3 +1,5 @@
+from django.db import transaction
+from django.db.models import Prefetch
 from rest_framework import (
     exceptions,
     serializers,
@@ -12,6 +14,13 @@ from .models import (
     ProcedureJointLink,
     ProcedureSite,
     ProcedureSiteRelationship,
+    readable_sites,
+)
+from .signals import defer_revisions
+from .validators import (
+    creates_joint_cycle,
+    creates_site_cycle,
+    find_cyclic_joints,
 )
 
 
@@ -56,6 +65,9 @@ class ProcedureJointLinkCreateSerializer(
         if not input_joint:
             raise exceptions.ValidationError('invalid input joint')
 
+        if creates_joint_cycle(validated_data['joint'].id, input_joint.id):
+            raise exceptions.ValidationError('cyclic joint links')
+
         # fill up extra fields and create joint input instance
         validated_data['input_joint'] = input_joint
         return super().create(validated_data)
@@ -109,7 +121,7 @@ class ProcedureJointCreateSerializer(ProcedureJointSerializer):
 
         # get inner procedure
         inner_procedure = Procedure.objects.filter(
-            site__user__uuid=user_uuid,
+            readable_sites(user_uuid, 'site__'),
             site__signature=inner_site_signature,
             signature=inner_procedure['signature'],
         ).first()
@@ -200,11 +212,12 @@ class ProcedureSiteCreateSerializer(ProcedureSiteSerializer):
         ]
 
     def create(self, validated_data):
-        # TODO: avoid recursive dependencies
+        # site being created has no sub sites yet, its base sites can not
+        # close a cycle
 
         base_sites = validated_data.pop('base_sites', [])
         base_sites = ProcedureSite.objects.filter(
-            user=validated_data['user'],
+            readable_sites(validated_data['user'].uuid),
             signature__in=[s['signature'] for s in base_sites],
         ).all()
 
@@ -237,14 +250,15 @@ class ProcedureSiteBaseSitesCreateSerializer(
         # get base site
         user_uuid = validated_data.pop('user_uuid')
         site = ProcedureSite.objects.filter(
-            user__uuid=user_uuid,
+            readable_sites(user_uuid),
             signature=validated_data['base']['signature']
         ).first()
 
         if not site:
             raise exceptions.ValidationError('invalid base site')
 
-        # TODO: avoid recursive dependencies
+        if creates_site_cycle(validated_data['sub'].id, site.id):
+            raise exceptions.ValidationError('cyclic base sites')
 
         # fill up missing fields and create site relationship
         validated_data['base'] = site
@@ -291,3 +305,297 @@ class ProcedureSerializer(serializers.ModelSerializer):
             'site',
             'editable',
         ]
+
+
+class ProcedureGraphJointSerializer(ProcedureJointSerializer):
+    site = serializers.CharField(
+        source='inner_procedure.site.signature',
+    )
+    procedure = serializers.CharField(
+        source='inner_procedure.signature',
+    )
+    links = ProcedureJointLinkCreateSerializer(
+        many=True,
+    )
+
+
+class ProcedureGraphOutputSerializer(ProcedureOutputSerializer):
+    link = ProcedureOutputLinkSerializer(
+        source='output_link',
+        allow_null=True,
+        default=None,
+    )
+
+    class Meta(ProcedureOutputSerializer.Meta):
+        fields = [
+            *ProcedureOutputSerializer.Meta.fields,
+            'link',
+        ]
+
+
+class ProcedureGraphSerializer(serializers.ModelSerializer):
+    """
+    whole graph of procedure as one document, saving it replaces
+    inputs, outputs, joints and their links in one transaction
+    """
+    inputs = ProcedureInputSerializer(
+        many=True,
+    )
+    outputs = ProcedureGraphOutputSerializer(
+        many=True,
+    )
+    joints = ProcedureGraphJointSerializer(
+        many=True,
+    )
+
+    class Meta:
+        model = Procedure
+        fields = [
+            'signature',
+            'inputs',
+            'outputs',
+            'joints',
+        ]
+        read_only_fields = [
+            'signature',
+        ]
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # whole graphs are loaded by a fixed number of queries
+        queryset = queryset.select_related('site').prefetch_related(None)
+        return queryset.prefetch_related(
+            Prefetch(
+                'inputs',
+                queryset=ProcedureInput.objects.order_by('index'),
+            ),
+            Prefetch(
+                'outputs',
+                queryset=ProcedureOutput.objects.select_related(
+                    'output_link__output_joint',
+                ).order_by('index'),
+            ),
+            Prefetch(
+                'joints',
+                queryset=ProcedureJoint.objects.select_related(
+                    'inner_procedure__site',
+                ).order_by('id'),
+            ),
+            Prefetch(
+                'joints__links',
+                queryset=ProcedureJointLink.objects.select_related(
+                    'input_joint',
+                ).order_by('index'),
+            ),
+        )
+
+    @staticmethod
+    def check_unique(values, message):
+        if len(set(values)) != len(values):
+            raise exceptions.ValidationError(message)
+
+    def validate(self, attrs):
+        self.check_unique(
+            [i['index'] for i in attrs['inputs']], 'duplicate input index')
+        self.check_unique(
+            [o['index'] for o in attrs['outputs']], 'duplicate output index')
+        self.check_unique(
+            [j['signature'] for j in attrs['joints']],
+            'duplicate joint signature',
+        )
+
+        joint_signatures = set(j['signature'] for j in attrs['joints'])
+        for joint in attrs['joints']:
+            self.check_unique(
+                [link['index'] for link in joint['links']],
+                'duplicate link index',
+            )
+            for link in joint['links']:
+                signature = link['input_joint']['signature']
+                if signature and signature not in joint_signatures:
+                    raise exceptions.ValidationError('invalid input joint')
+
+        if find_cyclic_joints(dict((j['signature'], [
+            link['input_joint']['signature'] for link in j['links']
+        ]) for j in attrs['joints'])):
+            raise exceptions.ValidationError('cyclic joint links')
+
+        for output in attrs['outputs']:
+            output_link = output['output_link']
+            if not output_link:
+                continue
+            signature = output_link['output_joint']['signature']
+            if signature and signature not in joint_signatures:
+                raise exceptions.ValidationError('invalid output joint')
+
+        # resolve inner procedures of all joints at once
+        base_sites = dict(self.instance.site.base_sites.values_list(
+            'signature',
+            'id',
+        ))
+        for joint in attrs['joints']:
+            if joint['inner_procedure']['site']['signature'] \
+                    not in base_sites:
+                raise exceptions.ValidationError(
+                    'procedure of joint should be in base sites')
+
+        inner_procedures = dict(
+            ((p.site_id, p.signature), p)
+            for p in Procedure.objects.filter(
+                site_id__in=base_sites.values(),
+                signature__in=set(
+                    j['inner_procedure']['signature']
+                    for j in attrs['joints']
+                ),
+            )
+        )
+        for joint in attrs['joints']:
+            inner_procedure = inner_procedures.get((
+                base_sites[joint['inner_procedure']['site']['signature']],
+                joint['inner_procedure']['signature'],
+            ))
+            if not inner_procedure:
+                raise exceptions.ValidationError('invalid procedure')
+            joint['inner_procedure'] = inner_procedure
+
+        return attrs
+
+    @staticmethod
+    def apply_diff(model, existing, desired, fields):
+        """
+        bulk create and update rows to make them as desired
+
+        :param existing: instances by key
+        :param desired: field values by key
+        :param fields: fields compared and updated of existing instances
+        :return: ids of existing instances not desired
+        """
+        created = []
+        updated = []
+        for key, values in desired.items():
+            instance = existing.get(key)
+            if instance is None:
+                created.append(model(**values))
+            elif any(getattr(instance, f) != values[f] for f in fields):
+                for f in fields:
+                    setattr(instance, f, values[f])
+                updated.append(instance)
+
+        if updated:
+            model.objects.bulk_update(updated, fields)
+        if created:
+            model.objects.bulk_create(created)
+
+        return [i.id for k, i in existing.items() if k not in desired]
+
+    def update(self, instance, validated_data):
+        with transaction.atomic(), defer_revisions() as revised:
+            # inputs and outputs, unless referenced by joints elsewhere
+            stale_ids = self.apply_diff(
+                ProcedureInput,
+                dict((i.index, i) for i in instance.inputs.all()),
+                dict((i['index'], {
+                    'procedure_id': instance.id,
+                    'index': i['index'],
+                    'signature': i['signature'],
+                }) for i in validated_data['inputs']),
+                ['signature'],
+            )
+            stale_inputs = ProcedureInput.objects.filter(id__in=stale_ids)
+            if ProcedureJointLink.objects.filter(
+                    joint__inner_procedure_id=instance.id,
+                    index__in=stale_inputs.values('index'),
+            ).exists():
+                raise exceptions.PermissionDenied(
+                    'can not delete input while its being referenced')
+            stale_inputs.delete()
+
+            stale_ids = self.apply_diff(
+                ProcedureOutput,
+                dict((o.index, o) for o in instance.outputs.all()),
+                dict((o['index'], {
+                    'procedure_id': instance.id,
+                    'index': o['index'],
+                    'signature': o['signature'],
+                }) for o in validated_data['outputs']),
+                ['signature'],
+            )
+            stale_outputs = ProcedureOutput.objects.filter(id__in=stale_ids)
+            if (
+                    ProcedureJointLink.objects.filter(
+                        input_joint__inner_procedure_id=instance.id,
+                        input_index__in=stale_outputs.values('index'),
+                    ).exists() or
+
+                    ProcedureOutputLink.objects.filter(
+                        output_joint__inner_procedure_id=instance.id,
+                        output_index__in=stale_outputs.values('index'),
+                    ).exists()
+            ):
+                raise exceptions.PermissionDenied(
+                    'can not delete output while its being referenced')
+            stale_outputs.delete()
+
+            # joints, stale ones are deleted after links referencing them
+            stale_joint_ids = self.apply_diff(
+                ProcedureJoint,
+                dict((j.signature, j) for j in instance.joints.all()),
+                dict((j['signature'], {
+                    'outer_procedure_id': instance.id,
+                    'signature': j['signature'],
+                    'inner_procedure_id': j['inner_procedure'].id,
+                }) for j in validated_data['joints']),
+                ['inner_procedure_id'],
+            )
+            joint_ids = dict(instance.joints.values_list('signature', 'id'))
+            output_ids = dict(instance.outputs.values_list('index', 'id'))
+
+            desired = {}
+            for joint in validated_data['joints']:
+                for link in joint['links']:
+                    joint_id = joint_ids[joint['signature']]
+                    desired[(joint_id, link['index'])] = {
+                        'joint_id': joint_id,
+                        'index': link['index'],
+                        'input_joint_id': joint_ids.get(
+                            link['input_joint']['signature']),
+                        'input_index': link['input_index'],
+                    }
+            stale_ids = self.apply_diff(
+                ProcedureJointLink,
+                dict(((j.joint_id, j.index), j) for j in (
+                    ProcedureJointLink.objects.filter(
+                        joint__outer_procedure=instance))),
+                desired,
+                ['input_joint_id', 'input_index'],
+            )
+            ProcedureJointLink.objects.filter(id__in=stale_ids).delete()
+
+            desired = {}
+            for output in validated_data['outputs']:
+                output_link = output['output_link']
+                if not output_link:
+                    continue
+                output_id = output_ids[output['index']]
+                desired[output_id] = {
+                    'output_id': output_id,
+                    'output_joint_id': joint_ids.get(
+                        output_link['output_joint']['signature']),
+                    'output_index': output_link['output_index'],
+                }
+            stale_ids = self.apply_diff(
+                ProcedureOutputLink,
+                dict((o.output_id, o) for o in (
+                    ProcedureOutputLink.objects.filter(
+                        output__procedure=instance))),
+                desired,
+                ['output_joint_id', 'output_index'],
+            )
+            ProcedureOutputLink.objects.filter(id__in=stale_ids).delete()
+
+            ProcedureJoint.objects.filter(id__in=stale_joint_ids).delete()
+
+            # bulk operations send no signals
+            revised.add(instance.id)
+
+        return instance
@@ -0,0 +1,135 @@
+import contextlib
+import threading
+
+from django.db.models import (
+    F,
+    signals,
+)
+from django.dispatch import (
+    Signal,
+    receiver,
+)
+
+from .models import (
+    Procedure,
+    ProcedureInput,
+    ProcedureOutput,
+    ProcedureOutputLink,
+    ProcedureJoint,
+    ProcedureJointLink,
+    ProcedureSiteRelationship,
+)
+
+# sent with ids of procedures whose graph have been changed,
+# including procedures depending on them through joints
+procedure_revised = Signal(providing_args=['procedure_ids'])
+
+deferred_revisions = threading.local()
+
+
+@contextlib.contextmanager
+def defer_revisions():
+    """
+    collect procedures revised within the block and revise them once
+    when it exits, yields the set of collected ids which callers of bulk
+    operations (that send no signals) add to themselves
+    """
+    pending = getattr(deferred_revisions, 'procedure_ids', None)
+    if pending is not None:
+        yield pending
+        return
+
+    deferred_revisions.procedure_ids = pending = set()
+    try:
+        yield pending
+    finally:
+        del deferred_revisions.procedure_ids
+    revise_procedures(pending)
+
+
+def revise_procedures(procedure_ids):
+    pending = getattr(deferred_revisions, 'procedure_ids', None)
+    if pending is not None:
+        pending.update(procedure_ids)
+        return
+
+    revised = set()
+    procedure_ids = set(procedure_ids)
+    while procedure_ids:
+        revised.update(procedure_ids)
+        procedure_ids = set(ProcedureJoint.objects.filter(
+            inner_procedure_id__in=procedure_ids,
+        ).values_list('outer_procedure_id', flat=True)) - revised
+
+    if not revised:
+        return
+
+    Procedure.objects.filter(
+        id__in=revised,
+    ).update(revision=F('revision') + 1)
+    procedure_revised.send(sender=Procedure, procedure_ids=revised)
+
+
+# receivers below skip raw saves, which happen while loading fixtures
+@receiver(signals.post_save, sender=Procedure)
+@receiver(signals.post_delete, sender=Procedure)
+def revise_by_procedure(instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    revise_procedures([instance.id])
+
+
+@receiver(signals.post_save, sender=ProcedureInput)
+@receiver(signals.post_delete, sender=ProcedureInput)
+@receiver(signals.post_save, sender=ProcedureOutput)
+@receiver(signals.post_delete, sender=ProcedureOutput)
+def revise_by_procedure_field(instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    revise_procedures([instance.procedure_id])
+
+
+@receiver(signals.post_save, sender=ProcedureJoint)
+@receiver(signals.post_delete, sender=ProcedureJoint)
+def revise_by_joint(instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    revise_procedures([instance.outer_procedure_id])
+
+
+@receiver(signals.post_save, sender=ProcedureJointLink)
+@receiver(signals.post_delete, sender=ProcedureJointLink)
+def revise_by_joint_link(instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    # joint may have been deleted already while cascading
+    revise_procedures(ProcedureJoint.objects.filter(
+        id=instance.joint_id,
+    ).values_list('outer_procedure_id', flat=True))
+
+
+@receiver(signals.post_save, sender=ProcedureOutputLink)
+@receiver(signals.post_delete, sender=ProcedureOutputLink)
+def revise_by_output_link(instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    # output may have been deleted already while cascading
+    revise_procedures(ProcedureOutput.objects.filter(
+        id=instance.output_id,
+    ).values_list('procedure_id', flat=True))
+
+
+@receiver(signals.post_save, sender=ProcedureSiteRelationship)
+@receiver(signals.post_delete, sender=ProcedureSiteRelationship)
+def revise_by_site_relationship(instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    revise_procedures(Procedure.objects.filter(
+        site_id=instance.sub_id,
+    ).values_list('id', flat=True))
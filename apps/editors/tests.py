@@ -1,3 +1,11 @@
+import json
+
+from django.db import (
+    IntegrityError,
+    connection,
+    transaction,
+)
+from django.test.utils import CaptureQueriesContext
 from mb_drf_extensions import test
 from rest_framework import (
     reverse,
@@ -5,6 +13,11 @@ from rest_framework import (
 )
 
 from ..scopes import scope_of_users
+from .models import (
+    Procedure,
+    ProcedureSite,
+)
+from .utils import load_builtin_procedures
 
 uuid_of_user = 'f0889553-0eef-11eb-b3e5-a87eea00b085'
 
@@ -31,6 +44,79 @@ class ProcedureSiteTest(test.APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertGreater(response.data.get('count'), 0)
 
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_init_site_queries(self):
+        url_init = reverse.reverse('editors:sites-init')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url_init)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        queries = len(context.captured_queries)
+        self.assertLess(queries, 30)
+
+        # initialized site is left as it is
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url_init)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(len(context.captured_queries), queries)
+        self.assertEqual(Procedure.objects.filter(
+            site__signature='builtin',
+            site__user=None,
+        ).count(), len(load_builtin_procedures()))
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_shared_builtin_site(self):
+        url_init = reverse.reverse('editors:sites-init')
+        response = self.client.post(url_init)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(ProcedureSite.objects.filter(
+            signature='builtin',
+        ).count(), 1)
+
+        # signatures of shared sites are unique, though null users are
+        # distinct to unique_together
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProcedureSite.objects.create(signature='builtin', user=None)
+
+        # shared site is readable and can be used as base site
+        url_detail = reverse.reverse('editors:sites-detail', ['builtin'])
+        response = self.client.get(url_detail)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        url_base_sites = reverse.reverse(
+            'editors:site-base-sites-list', ['test-site-1'])
+        response = self.client.post(
+            url_base_sites, data={'signature': 'builtin'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        url_inputs = reverse.reverse('editors:procedure-inputs-list', [
+            'builtin',
+            'float-add',
+        ])
+        response = self.client.get(url_inputs)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.get('count'), 2)
+
+        # but not writable
+        response = self.client.delete(url_detail)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        url_detail = reverse.reverse('editors:procedures-detail', [
+            'builtin',
+            'float-add',
+        ])
+        response = self.client.patch(url_detail, data={'docstring': ''})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        url_create = reverse.reverse('editors:sites-list')
+        response = self.client.post(url_create, data={'signature': 'builtin'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
     def test_init_site_by_builtin_user(self):
         # init api will generate builtin site and procedures
         url_init = reverse.reverse('editors:sites-init')
@@ -123,6 +209,21 @@ class ProcedureSiteTest(test.APITestCase):
             url_base_sites, data={'signature': 'test-site-1'})
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_create_cyclic_base_sites(self):
+        url_base_sites = reverse.reverse(
+            'editors:site-base-sites-list', ['test-site-1'])
+        response = self.client.post(
+            url_base_sites, data={'signature': 'test-site-3'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(
+            url_base_sites, data={'signature': 'test-site-1'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     @test.authentication_mock(
         user_uuid=uuid_of_user,
         user_scopes=[scope_of_users]
@@ -174,6 +275,53 @@ class ProcedureSiteTest(test.APITestCase):
         response = self.client.delete(url_base_sites)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_export_import_site(self):
+        url_export = reverse.reverse('editors:sites-export', ['test-site-2'])
+        response = self.client.get(url_export)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+
+        header = json.loads(lines[0])
+        self.assertEqual(header.get('base_sites'), ['test-site-1'])
+        procedure = json.loads(lines[1])
+        self.assertEqual(procedure.get('signature'), 'test-procedure-2')
+        self.assertEqual(len(procedure.get('joints')), 2)
+
+        # import archive as another site of same user
+        url_import = reverse.reverse('editors:sites-import')
+        response = self.client.post(
+            url_import,
+            data='\n'.join(lines),
+            content_type='application/x-ndjson',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        header['signature'] = 'test-site-4'
+        lines[0] = json.dumps(header)
+        response = self.client.post(
+            url_import,
+            data='\n'.join(lines),
+            content_type='application/x-ndjson',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data.get('signature'), 'test-site-4')
+
+        url_graph = reverse.reverse('editors:procedures-graph', [
+            'test-site-4',
+            'test-procedure-2',
+        ])
+        response = self.client.get(url_graph)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data['outputs'][0]['link']['output_joint'],
+            'test-procedure-2-joint-1',
+        )
+
 
 class ProcedureTest(test.APITestCase):
     fixtures = [
@@ -370,6 +518,30 @@ class ProcedureJointTest(test.APITestCase):
         })
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_create_joint_revises_procedure(self):
+        procedure = Procedure.objects.get(
+            site__signature='test-site-2',
+            signature='test-procedure-2',
+        )
+        url_list = reverse.reverse(
+            'editors:procedure-joints-list',
+            ['test-site-2', 'test-procedure-2']
+        )
+        response = self.client.post(url_list, data={
+            'signature': 'test-joint-1',
+            'site': 'test-site-1',
+            'procedure': 'test-procedure-1',
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        revision = procedure.revision
+        procedure.refresh_from_db()
+        self.assertGreater(procedure.revision, revision)
+
     @test.authentication_mock(
         user_uuid=uuid_of_user,
         user_scopes=[scope_of_users]
@@ -456,7 +628,7 @@ class ProcedureJointTest(test.APITestCase):
 
         response = self.client.post(url_list, data={
             'index': 2,
-            'input_joint': 'test-procedure-2-joint-1',
+            'input_joint': 'test-procedure-2-joint-2',
             'input_index': 0,
         })
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
@@ -467,6 +639,26 @@ class ProcedureJointTest(test.APITestCase):
         })
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+        # links forming cycles are rejected
+        response = self.client.post(url_list, data={
+            'index': 3,
+            'input_joint': 'test-procedure-2-joint-1',
+            'input_index': 0,
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        url_list = reverse.reverse('editors:procedure-joint-links-list', [
+            'test-site-2',
+            'test-procedure-2',
+            'test-procedure-2-joint-2',
+        ])
+        response = self.client.post(url_list, data={
+            'index': 0,
+            'input_joint': 'test-procedure-2-joint-1',
+            'input_index': 0,
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     @test.authentication_mock(
         user_uuid=uuid_of_user,
         user_scopes=[scope_of_users]
@@ -640,3 +832,122 @@ class ProcedureOutputTest(test.APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(
             response.data.get('output_joint'), 'test-procedure-2-joint-2')
+
+
+class ProcedureGraphTest(test.APITestCase):
+    fixtures = [
+        'test_users.json',
+        'test_editors.json',
+    ]
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_retrieve_graph(self):
+        url_graph = reverse.reverse('editors:procedures-graph', [
+            'test-site-2',
+            'test-procedure-2',
+        ])
+        response = self.client.get(url_graph)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data.get('inputs')), 1)
+        self.assertEqual(
+            response.data['outputs'][0]['link']['output_joint'],
+            'test-procedure-2-joint-1',
+        )
+        self.assertEqual(
+            [j['signature'] for j in response.data.get('joints')],
+            ['test-procedure-2-joint-1', 'test-procedure-2-joint-2'],
+        )
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_update_graph(self):
+        procedure = Procedure.objects.get(
+            site__signature='test-site-2',
+            signature='test-procedure-2',
+        )
+        url_graph = reverse.reverse('editors:procedures-graph', [
+            'test-site-2',
+            'test-procedure-2',
+        ])
+        graph = {
+            'inputs': [
+                {'signature': 'test-procedure-2-input-1', 'index': 0},
+                {'signature': 'test-procedure-2-input-2', 'index': 1},
+            ],
+            'outputs': [{
+                'signature': 'test-procedure-2-output-1',
+                'index': 0,
+                'link': {'output_joint': 'joint-b', 'output_index': 0},
+            }],
+            'joints': [{
+                'signature': 'joint-a',
+                'site': 'test-site-1',
+                'procedure': 'test-procedure-1',
+                'links': [{'index': 0, 'input_index': 1}],
+            }, {
+                'signature': 'joint-b',
+                'site': 'test-site-1',
+                'procedure': 'test-procedure-3',
+                'links': [{
+                    'index': 0,
+                    'input_joint': 'joint-a',
+                    'input_index': 0,
+                }],
+            }],
+        }
+        response = self.client.put(url_graph, data=graph, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [j['signature'] for j in response.data.get('joints')],
+            ['joint-a', 'joint-b'],
+        )
+        self.assertEqual(
+            response.data['outputs'][0]['link']['output_joint'], 'joint-b')
+        self.assertEqual(procedure.joints.count(), 2)
+
+        revision = procedure.revision
+        procedure.refresh_from_db()
+        self.assertGreater(procedure.revision, revision)
+
+        # invalid graph leaves saved one untouched
+        graph['joints'][1]['links'][0]['input_joint'] = 'joint-c'
+        response = self.client.put(url_graph, data=graph, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        graph['joints'][1]['links'][0]['input_joint'] = 'joint-a'
+        graph['joints'][0]['links'][0]['input_joint'] = 'joint-b'
+        response = self.client.put(url_graph, data=graph, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        graph['joints'][0]['links'][0]['input_joint'] = None
+        graph['joints'][1]['site'] = 'test-site-3'
+        response = self.client.put(url_graph, data=graph, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(procedure.joints.count(), 2)
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_validate_procedure(self):
+        url_validate = reverse.reverse('editors:procedures-validate', [
+            'test-site-2',
+            'test-procedure-2',
+        ])
+        response = self.client.get(url_validate)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data.get('valid'))
+        self.assertEqual(response.data.get('unconnected_inputs'), [{
+            'joint': 'test-procedure-2-joint-2',
+            'index': 0,
+        }])
+        self.assertEqual(
+            response.data.get('dangling_joints'),
+            ['test-procedure-2-joint-2'],
+        )
+        self.assertEqual(response.data.get('cyclic_joints'), [])
@@ -1,7 +1,14 @@
+import collections
+import functools
+
 from abei.interfaces import (
     IProcedureSiteFactory,
     service_entry as _,
 )
+from django.db import (
+    IntegrityError,
+    transaction,
+)
 
 from ..settings import (
     default_service_site,
@@ -12,43 +19,99 @@ from .models import (
     ProcedureOutput,
     ProcedureSite,
 )
+from .signals import revise_procedures
+
+BuiltinProcedure = collections.namedtuple('BuiltinProcedure', [
+    'signature',
+    'docstring',
+    'input_signatures',
+    'output_signatures',
+])
 
 
-def init_sites(user):
+@functools.lru_cache(maxsize=None)
+def load_builtin_procedures():
+    """
+    catalog of builtin procedures, materialized once per process
+    """
     site_factory = default_service_site.get_service(
         _(IProcedureSiteFactory)
     )
     site = site_factory.create(None, builtin=True)
-    site_instance, __ = ProcedureSite.objects.get_or_create(
-        signature='builtin',
-        user=user,
-    )
 
+    procedures = []
     for procedure_signature in site.iterate_procedures():
         procedure = site.query_procedure(procedure_signature)
-        procedure_instance, __ = Procedure.objects.get_or_create(
+        procedures.append(BuiltinProcedure(
             signature=procedure_signature,
-            site=site_instance,
-            defaults={
-                'editable': False,
-                'docstring': procedure.get_docstring(),
-            },
+            docstring=procedure.get_docstring(),
+            input_signatures=tuple(procedure.get_input_signatures()),
+            output_signatures=tuple(procedure.get_output_signatures()),
+        ))
+    return tuple(procedures)
+
+
+def init_sites(retries=3):
+    """
+    create builtin site shared by all users, or add what is missing from
+    it, by a fixed number of queries. initialization is retried when rows
+    are inserted concurrently by another initialization
+    """
+    for attempt in range(retries):
+        try:
+            return init_builtin_site()
+        except IntegrityError:
+            if attempt == retries - 1:
+                raise
+
+
+def init_builtin_site():
+    catalog = load_builtin_procedures()
+
+    with transaction.atomic():
+        site_instance, __ = ProcedureSite.objects.get_or_create(
+            signature='builtin',
+            user=None,
         )
 
-        for i, input_signature in enumerate(
-                procedure.get_input_signatures()
-        ):
-            ProcedureInput.objects.get_or_create(
-                procedure=procedure_instance,
-                signature=input_signature,
-                index=i,
-            )
-
-        for i, output_signature in enumerate(
-                procedure.get_output_signatures()
-        ):
-            ProcedureOutput.objects.get_or_create(
-                procedure=procedure_instance,
-                signature=output_signature,
-                index=i,
-            )
+        existing = set(site_instance.procedures.values_list(
+            'signature', flat=True))
+        Procedure.objects.bulk_create([
+            Procedure(
+                signature=p.signature,
+                site=site_instance,
+                editable=False,
+                docstring=p.docstring,
+            ) for p in catalog if p.signature not in existing
+        ])
+        procedure_ids = dict(site_instance.procedures.values_list(
+            'signature', 'id'))
+
+        # bulk inserts send no signals, existing procedures getting new
+        # fields are revised explicitly
+        revised = set()
+        for model, field in [
+            (ProcedureInput, 'input_signatures'),
+            (ProcedureOutput, 'output_signatures'),
+        ]:
+            existing_fields = set(model.objects.filter(
+                procedure__site=site_instance,
+            ).values_list('procedure_id', 'index'))
+
+            instances = []
+            for p in catalog:
+                procedure_id = procedure_ids[p.signature]
+                for i, signature in enumerate(getattr(p, field)):
+                    if (procedure_id, i) in existing_fields:
+                        continue
+                    instances.append(model(
+                        procedure_id=procedure_id,
+                        signature=signature,
+                        index=i,
+                    ))
+                    if p.signature in existing:
+                        revised.add(procedure_id)
+            model.objects.bulk_create(instances)
+
+        if revised:
+            revise_procedures(revised)
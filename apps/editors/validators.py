@@ -0,0 +1,187 @@
+import collections
+
+from .models import (
+    ProcedureInput,
+    ProcedureJointLink,
+    ProcedureOutput,
+    ProcedureSiteRelationship,
+)
+
+
+def is_reachable(source_id, target_id, get_next_ids):
+    """
+    walk edges breadth first from source, one query per level, only rows
+    reachable from source are visited
+
+    :param get_next_ids: function returning ids next to a set of ids
+    """
+    visited = {source_id}
+    frontier = {source_id}
+    while frontier:
+        if target_id in frontier:
+            return True
+        frontier = set(get_next_ids(frontier)) - visited
+        visited.update(frontier)
+    return False
+
+
+def creates_site_cycle(sub_id, base_id):
+    """
+    :return: True if making base a base site of sub closes a cycle, which
+        happens when sub is base site of base already, directly or not
+    """
+    return is_reachable(
+        base_id,
+        sub_id,
+        lambda ids: ProcedureSiteRelationship.objects.filter(
+            sub_id__in=ids,
+        ).values_list('base_id', flat=True),
+    )
+
+
+def creates_joint_cycle(joint_id, input_joint_id):
+    """
+    :return: True if linking output of input joint to joint closes a
+        cycle, which happens when input joint reads joint already,
+        directly or not
+    """
+    return is_reachable(
+        input_joint_id,
+        joint_id,
+        lambda ids: ProcedureJointLink.objects.filter(
+            joint_id__in=ids,
+            input_joint__isnull=False,
+        ).values_list('input_joint_id', flat=True),
+    )
+
+
+def find_cyclic_joints(dependencies):
+    """
+    :param dependencies: input joints by joint, of one procedure
+    :return: joints on cycles or reading joints on cycles
+    """
+    pending = dict(
+        (j, set(d for d in deps if d in dependencies))
+        for j, deps in dependencies.items()
+    )
+    dependents = collections.defaultdict(list)
+    for j, deps in pending.items():
+        for d in deps:
+            dependents[d].append(j)
+
+    # joints are resolved once all their inputs are
+    ready = [j for j, deps in pending.items() if not deps]
+    while ready:
+        j = ready.pop()
+        del pending[j]
+        for k in dependents[j]:
+            pending[k].discard(j)
+            if not pending[k]:
+                ready.append(k)
+
+    return set(pending)
+
+
+def validate_procedure(procedure):
+    """
+    report problems of procedure graph found before it is run, graph
+    should have been prefetched as by
+    `ProcedureGraphSerializer.setup_eager_loading`. dangling joints, whose
+    outputs reach no output of procedure, are reported but do not make
+    procedure invalid
+    """
+    inputs = procedure.inputs.all()
+
+    # builtin procedures have no graph, their outputs are native
+    if procedure.site.signature == 'builtin':
+        outputs = []
+    else:
+        outputs = procedure.outputs.all()
+    joints = list(procedure.joints.all())
+    joint_links = dict((j.id, list(j.links.all())) for j in joints)
+
+    inner_procedure_ids = set(j.inner_procedure_id for j in joints)
+    input_counts = collections.Counter(ProcedureInput.objects.filter(
+        procedure_id__in=inner_procedure_ids,
+    ).values_list('procedure_id', flat=True))
+    output_counts = collections.Counter(ProcedureOutput.objects.filter(
+        procedure_id__in=inner_procedure_ids,
+    ).values_list('procedure_id', flat=True))
+    joint_output_counts = dict(
+        (j.id, output_counts[j.inner_procedure_id]) for j in joints)
+    input_indices = set(i.index for i in inputs)
+
+    def is_valid_source(input_joint_id, index):
+        if input_joint_id is None:
+            return index in input_indices
+        return 0 <= index < joint_output_counts.get(input_joint_id, 0)
+
+    unconnected_inputs = []
+    invalid_links = []
+    for joint in joints:
+        input_count = input_counts[joint.inner_procedure_id]
+        linked = set()
+        for link in joint_links[joint.id]:
+            linked.add(link.index)
+            if not 0 <= link.index < input_count or not is_valid_source(
+                    link.input_joint_id, link.input_index):
+                invalid_links.append({
+                    'joint': joint.signature,
+                    'index': link.index,
+                })
+        unconnected_inputs.extend(
+            {'joint': joint.signature, 'index': i}
+            for i in range(input_count) if i not in linked
+        )
+
+    unconnected_outputs = []
+    invalid_output_links = []
+    output_joint_ids = set()
+    for output in outputs:
+        if not hasattr(output, 'output_link'):
+            unconnected_outputs.append(output.index)
+            continue
+
+        output_link = output.output_link
+        if not is_valid_source(
+                output_link.output_joint_id, output_link.output_index):
+            invalid_output_links.append(output.index)
+        if output_link.output_joint_id:
+            output_joint_ids.add(output_link.output_joint_id)
+
+    # joints read by outputs, directly or not, are connected
+    connected = set()
+    frontier = output_joint_ids
+    while frontier:
+        connected.update(frontier)
+        frontier = set(
+            link.input_joint_id
+            for j in frontier for link in joint_links.get(j, [])
+            if link.input_joint_id
+        ) - connected
+
+    joint_signatures = dict((j.id, j.signature) for j in joints)
+    cyclic_joints = find_cyclic_joints(dict(
+        (j, [link.input_joint_id for link in links])
+        for j, links in joint_links.items()
+    ))
+
+    report = {
+        'unconnected_inputs': unconnected_inputs,
+        'unconnected_outputs': unconnected_outputs,
+        'invalid_links': invalid_links,
+        'invalid_output_links': invalid_output_links,
+        'cyclic_joints': sorted(joint_signatures[j] for j in cyclic_joints),
+        'dangling_joints': sorted(
+            j.signature for j in joints if j.id not in connected),
+    }
+    report['valid'] = not any(
+        report[k] for k in [
+            'unconnected_inputs',
+            'unconnected_outputs',
+            'invalid_links',
+            'invalid_output_links',
+            'cyclic_joints',
+        ]
+    )
+    return report
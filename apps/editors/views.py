@@ -2,12 +2,14 @@ from django.db import (
     IntegrityError,
     models,
 )
+from django.http import StreamingHttpResponse
 from rest_framework import (
     decorators,
     exceptions,
     mixins,
     permissions,
     response,
+    status,
     viewsets,
 )
 
@@ -18,6 +20,10 @@ from ..permissions import (
     UserPermission,
 )
 
+from .archives import (
+    export_site,
+    import_site,
+)
 from .filters import (
     ProcedureSiteFilterSet,
     ProcedureFilterSet,
@@ -31,10 +37,12 @@ from .models import (
     ProcedureOutputLink,
     ProcedureSite,
     ProcedureSiteRelationship,
+    readable_sites,
 )
 
 from .serializers import (
     ProcedureSerializer,
+    ProcedureGraphSerializer,
     ProcedureJointSerializer,
     ProcedureJointCreateSerializer,
     ProcedureJointLinkSerializer,
@@ -48,6 +56,7 @@ from .serializers import (
     ProcedureSiteBaseSitesCreateSerializer,
 )
 from .utils import init_sites
+from .validators import validate_procedure
 
 
 class ProcedureSiteViewSet(
@@ -64,8 +73,11 @@ class ProcedureSiteViewSet(
     serializer_class = ProcedureSiteSerializer
 
     def get_queryset(self):
-        return super().get_queryset().filter(
-            user__uuid=self.request.user.uuid)
+        qs = super().get_queryset()
+        if self.request.method in permissions.SAFE_METHODS:
+            return qs.filter(readable_sites(self.request.user.uuid))
+
+        return qs.filter(user__uuid=self.request.user.uuid)
 
     def get_serializer_class(self):
         if self.action in ['create']:
@@ -73,6 +85,13 @@ class ProcedureSiteViewSet(
         return super().get_serializer_class()
 
     def perform_create(self, serializer):
+        if ProcedureSite.objects.filter(
+                user=None,
+                signature=serializer.validated_data['signature'],
+        ).exists():
+            raise exceptions.PermissionDenied(
+                'signature of shared site is reserved')
+
         serializer.save(user=self.request.user.user_persist())
 
     def perform_destroy(self, instance):
@@ -86,9 +105,38 @@ class ProcedureSiteViewSet(
         detail=False,
     )
     def init(self, request, *args, **kwargs):
-        init_sites(user=self.request.user.user_persist())
+        init_sites()
         return response.Response()
 
+    @decorators.action(
+        methods=['get'],
+        detail=True,
+    )
+    def export(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return StreamingHttpResponse(
+            export_site(instance),
+            content_type='application/x-ndjson',
+        )
+
+    @decorators.action(
+        methods=['post'],
+        url_name='import',
+        url_path='import',
+        detail=False,
+    )
+    def import_(self, request, *args, **kwargs):
+        # archive is read line by line from body, bypassing parsers
+        instance = import_site(
+            self.request.user.user_persist(),
+            request.stream or [],
+        )
+        serializer = ProcedureSiteSerializer(instance=instance)
+        return response.Response(
+            serializer.data,
+            status=status.HTTP_201_CREATED,
+        )
+
 
 class ProcedureSiteBaseSitesViewSet(
     NestedViewSetMixin,
@@ -105,7 +153,7 @@ class ProcedureSiteBaseSitesViewSet(
 
     def get_queryset(self):
         return super().get_queryset().filter(
-            base__user__uuid=self.request.user.uuid,
+            readable_sites(self.request.user.uuid, 'base__'),
             sub__user__uuid=self.request.user.uuid,
         )
 
@@ -157,13 +205,17 @@ class ProcedureViewSet(
     serializer_class = ProcedureSerializer
 
     def get_queryset(self):
-        qs = super().get_queryset().filter(
-            site__user__uuid=self.request.user.uuid)
+        qs = super().get_queryset()
+        if self.action in ['graph', 'set_graph', 'validate']:
+            qs = ProcedureGraphSerializer.setup_eager_loading(qs)
 
         if self.request.method in permissions.SAFE_METHODS:
-            return qs
+            return qs.filter(readable_sites(self.request.user.uuid, 'site__'))
 
-        return qs.filter(editable=True)
+        return qs.filter(
+            site__user__uuid=self.request.user.uuid,
+            editable=True,
+        )
 
     def perform_create(self, serializer):
         site = ProcedureSite.objects.filter(
@@ -191,6 +243,35 @@ class ProcedureViewSet(
         except models.ProtectedError as e:
             raise exceptions.PermissionDenied(str(e))
 
+    @decorators.action(
+        detail=True,
+        serializer_class=ProcedureGraphSerializer,
+    )
+    def graph(self, request, *args, **kwargs):
+        serializer = self.get_serializer(instance=self.get_object())
+        return response.Response(serializer.data)
+
+    @graph.mapping.put
+    def set_graph(self, request, *args, **kwargs):
+        serializer = self.get_serializer(
+            instance=self.get_object(),
+            data=request.data,
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        # read saved graph back instead of stale prefetched one
+        serializer = self.get_serializer(instance=self.get_object())
+        return response.Response(serializer.data)
+
+    @decorators.action(
+        methods=['get'],
+        detail=True,
+    )
+    def validate(self, request, *args, **kwargs):
+        # problems of graph are reported instead of failing runs
+        return response.Response(validate_procedure(self.get_object()))
+
 
 class ProcedureJointViewSet(
     NestedViewSetMixin,
@@ -202,13 +283,15 @@ class ProcedureJointViewSet(
     serializer_class = ProcedureJointSerializer
 
     def get_queryset(self):
-        qs = super().get_queryset().filter(
-            outer_procedure__site__user__uuid=self.request.user.uuid
-        )
+        qs = super().get_queryset()
         if self.request.method in permissions.SAFE_METHODS:
-            return qs
+            return qs.filter(readable_sites(
+                self.request.user.uuid, 'outer_procedure__site__'))
 
-        return qs.filter(outer_procedure__editable=True)
+        return qs.filter(
+            outer_procedure__site__user__uuid=self.request.user.uuid,
+            outer_procedure__editable=True,
+        )
 
     def get_serializer_class(self):
         if self.action in ['create']:
@@ -255,13 +338,15 @@ class ProcedureJointLinkViewSet(
     serializer_class = ProcedureJointLinkSerializer
 
     def get_queryset(self):
-        qs = super().get_queryset().filter(
-            joint__outer_procedure__site__user__uuid=self.request.user.uuid)
-
+        qs = super().get_queryset()
         if self.request.method in permissions.SAFE_METHODS:
-            return qs
+            return qs.filter(readable_sites(
+                self.request.user.uuid, 'joint__outer_procedure__site__'))
 
-        return qs.filter(joint__outer_procedure__editable=True)
+        return qs.filter(
+            joint__outer_procedure__site__user__uuid=self.request.user.uuid,
+            joint__outer_procedure__editable=True,
+        )
 
     def get_serializer_class(self):
         if self.action in ['create']:
@@ -300,13 +385,15 @@ class ProcedureInputViewSet(
     serializer_class = ProcedureInputSerializer
 
     def get_queryset(self):
-        qs = super().get_queryset().filter(
-            procedure__site__user__uuid=self.request.user.uuid)
-
+        qs = super().get_queryset()
         if self.request.method in permissions.SAFE_METHODS:
-            return qs
+            return qs.filter(readable_sites(
+                self.request.user.uuid, 'procedure__site__'))
 
-        return qs.filter(procedure__editable=True)
+        return qs.filter(
+            procedure__site__user__uuid=self.request.user.uuid,
+            procedure__editable=True,
+        )
 
     def perform_create(self, serializer):
         procedure = Procedure.objects.filter(
@@ -352,13 +439,15 @@ class ProcedureOutputViewSet(
     serializer_class = ProcedureOutputSerializer
 
     def get_queryset(self):
-        qs = super().get_queryset().filter(
-            procedure__site__user__uuid=self.request.user.uuid)
-
+        qs = super().get_queryset()
         if self.request.method in permissions.SAFE_METHODS:
-            return qs
+            return qs.filter(readable_sites(
+                self.request.user.uuid, 'procedure__site__'))
 
-        return qs.filter(procedure__editable=True)
+        return qs.filter(
+            procedure__site__user__uuid=self.request.user.uuid,
+            procedure__editable=True,
+        )
 
     def perform_create(self, serializer):
         procedure = Procedure.objects.filter(
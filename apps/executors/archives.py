@@ -0,0 +1,178 @@
+import datetime
+import gzip
+import json
+import logging
+import os
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .codecs import decode_values
+from .models import ProcedureRun
+
+logger = logging.getLogger(__name__)
+
+
+class ProcedureRunArchive(object):
+    """
+    compressed ndjson files of pruned runs, partitioned by the day runs
+    were created and by their user, one file per pruned batch named by
+    the first run id of the batch:
+        <directory>/<yyyy-mm-dd>/<user uuid>/<run id>.ndjson.gz
+    files are written whole and renamed into place, a batch archived
+    again after its deletion failed replaces its own files, and runs
+    archived twice by batches of different bounds are read once
+    """
+    fields = [
+        'uuid',
+        'user__uuid',
+        'procedure__site__signature',
+        'procedure__signature',
+        'status',
+        'created_time',
+        'finished_time',
+        'inputs',
+        'outputs',
+        'errors',
+    ]
+    names = [
+        'uuid',
+        'user',
+        'site',
+        'procedure',
+        'status',
+        'created_time',
+        'finished_time',
+        'inputs',
+        'outputs',
+        'errors',
+    ]
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @staticmethod
+    def format_value(value):
+        if isinstance(value, datetime.datetime):
+            return value.isoformat()
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        if isinstance(value, (bytes, memoryview)):
+            return decode_values(value)
+        return value
+
+    def make_record(self, row):
+        return dict(zip(self.names, [self.format_value(v) for v in row]))
+
+    def get_directory(self, date, user_uuid):
+        return os.path.join(self.directory, date, str(user_uuid or 'none'))
+
+    def write(self, queryset, batch_id):
+        """
+        write runs of queryset to files of their partitions, files are
+        synced to disk before being renamed into place
+
+        :param batch_id: first run id of batch, naming its files
+        :return: number of archived runs
+        """
+        partitions = {}
+        for row in queryset.values_list(*self.fields):
+            record = self.make_record(row)
+            partitions.setdefault(
+                (record['created_time'][:10], record['user']), [],
+            ).append(record)
+
+        for (date, user_uuid), records in partitions.items():
+            directory = self.get_directory(date, user_uuid)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(
+                directory, '{:012d}.ndjson.gz'.format(batch_id))
+            temp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temp_path, 'wb') as f:
+                with gzip.GzipFile(fileobj=f, mode='wb') as g:
+                    g.write(''.join(
+                        json.dumps(r) + '\n' for r in records
+                    ).encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+
+        return sum(len(r) for r in partitions.values())
+
+    def read(self, user_uuid, date_from=None, date_to=None):
+        """
+        iterate archived runs of user, oldest partition first
+
+        :param date_from: first day (yyyy-mm-dd) to read, inclusive
+        :param date_to: last day (yyyy-mm-dd) to read, inclusive
+        """
+        if not os.path.isdir(self.directory):
+            return
+
+        for date in sorted(os.listdir(self.directory)):
+            if date_from and date < date_from:
+                continue
+            if date_to and date > date_to:
+                break
+
+            directory = self.get_directory(date, user_uuid)
+            if not os.path.isdir(directory):
+                continue
+
+            seen = set()
+            for name in sorted(os.listdir(directory)):
+                if not name.endswith('.ndjson.gz'):
+                    continue  # files being written
+
+                with gzip.open(
+                        os.path.join(directory, name),
+                        'rt',
+                        encoding='utf-8',
+                ) as f:
+                    for line in f:
+                        record = json.loads(line)
+                        if record['uuid'] in seen:
+                            continue
+                        seen.add(record['uuid'])
+                        yield record
+
+
+class DefaultProcedureRunArchive(ProcedureRunArchive):
+    def __init__(self):
+        config = getattr(settings, 'ABEI_API_RUN_RETENTION', {})
+        super().__init__(config.get('ARCHIVE_DIR') or os.path.join(
+            settings.BASE_DIR, 'archives'))
+
+
+default_procedure_run_archive = DefaultProcedureRunArchive()
+
+
+def prune_procedure_runs(days, archive=None, batch_size=1000):
+    """
+    delete finished runs older than `days` in batches of `batch_size`,
+    each batch is archived first and then deleted in its own short
+    transaction
+
+    :return: number of pruned runs
+    """
+    before = timezone.now() - datetime.timedelta(days=days)
+    pruned = 0
+    while True:
+        run_ids = list(ProcedureRun.objects.filter(
+            status='finished',
+            created_time__lt=before,
+        ).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not run_ids:
+            return pruned
+
+        # runs are deleted only once their archive files are on disk
+        queryset = ProcedureRun.objects.filter(id__in=run_ids)
+        if archive:
+            archive.write(queryset.order_by('id'), run_ids[0])
+        with transaction.atomic():
+            queryset.delete()
+
+        pruned += len(run_ids)
+        logger.info('{} runs pruned'.format(pruned))
@@ -0,0 +1,324 @@
+import datetime
+import random
+import statistics
+import time
+import tracemalloc
+import urllib.parse
+import uuid
+
+from django.apps import apps
+from django.db import (
+    connection,
+    models,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import test
+
+from ..authentication import AuthenticatedUser
+from ..scopes import scope_of_users
+from .builders import ProcedureBuilder
+from .codecs import encode_values
+from .models import ProcedureRun
+from .tasks import (
+    run_procedure,
+    run_procedure_batch,
+)
+from .views import ProcedureRunLogViewSet
+
+benchmark_builtins = [
+    'float-add',
+    'float-sub',
+]
+
+
+def create_benchmark_node(site, signature, fan_in, builtins, rand):
+    """
+    create procedure of `fan_in` float inputs folded into one output by
+    a chain of binary builtin procedures
+    """
+    procedure_model = apps.get_model('editors.Procedure')
+    procedure = procedure_model.objects.create(
+        signature=signature,
+        site=site,
+    )
+    for i in range(fan_in):
+        procedure.inputs.create(signature='float', index=i)
+
+    joint = None
+    for i in range(1, fan_in):
+        previous = joint
+        joint = procedure.joints.create(
+            signature='fold_{}'.format(i),
+            inner_procedure=rand.choice(builtins),
+        )
+        joint.links.create(index=0, input_joint=previous, input_index=0)
+        joint.links.create(index=1, input_index=i)
+
+    apps.get_model('editors.ProcedureOutputLink').objects.create(
+        output=procedure.outputs.create(signature='float', index=0),
+        output_joint=joint,
+        output_index=0,
+    )
+    return procedure
+
+
+def create_benchmark_procedure(
+        site,
+        signature,
+        depth,
+        width,
+        fan_in=2,
+        diamond_density=0.5,
+        seed=0,
+):
+    """
+    create procedure of `width` float inputs and outputs whose joints
+    form `depth` layers of `width` joints, each reading `fan_in` values.
+    joint k of a layer reads joint k of the previous layer first, then
+    with probability `diamond_density` joint k + i of it (forming
+    diamonds), or otherwise an input. joints refer to binary builtin
+    procedures, or to a composite folding `fan_in` values beyond 2
+
+    :param site: site inheriting shared builtin site
+    """
+    procedure_model = apps.get_model('editors.Procedure')
+    joint_model = apps.get_model('editors.ProcedureJoint')
+    link_model = apps.get_model('editors.ProcedureJointLink')
+    output_link_model = apps.get_model('editors.ProcedureOutputLink')
+
+    builtins = list(procedure_model.objects.filter(
+        site__in=site.base_sites.all(),
+        signature__in=benchmark_builtins,
+    ))
+    if not builtins:
+        raise ValueError('builtin procedures are not initialized')
+
+    rand = random.Random(seed)
+    if fan_in > 2:
+        inner_procedures = [create_benchmark_node(
+            site,
+            '{}-node'.format(signature),
+            fan_in,
+            builtins,
+            rand,
+        )]
+    else:
+        inner_procedures = builtins
+
+    procedure = procedure_model.objects.create(
+        signature=signature,
+        site=site,
+    )
+    for i in range(width):
+        procedure.inputs.create(signature='float', index=i)
+
+    layer = [None] * width
+    for d in range(depth):
+        links = []
+        joints = []
+        for k in range(width):
+            joint = joint_model.objects.create(
+                signature='j_{}_{}'.format(d, k),
+                outer_procedure=procedure,
+                inner_procedure=rand.choice(inner_procedures),
+            )
+            sources = [(layer[k], 0) if layer[k] else (None, k)]
+            for i in range(1, fan_in):
+                if layer[0] and rand.random() < diamond_density:
+                    sources.append((layer[(k + i) % width], 0))
+                else:
+                    sources.append((None, rand.randrange(width)))
+
+            links.extend(
+                link_model(
+                    joint=joint,
+                    index=i,
+                    input_joint=input_joint,
+                    input_index=input_index,
+                ) for i, (input_joint, input_index) in enumerate(sources)
+            )
+            joints.append(joint)
+
+        link_model.objects.bulk_create(links)
+        layer = joints
+
+    for k in range(width):
+        output_link_model.objects.create(
+            output=procedure.outputs.create(signature='float', index=k),
+            output_joint=layer[k],
+            output_index=0,
+        )
+
+    return procedure
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'mean': statistics.mean(samples),
+        'median': statistics.median(samples),
+        'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        'max': samples[-1],
+    }
+
+
+def benchmark_procedure(procedure, repeat=100, batch_size=1000, seed=0):
+    """
+    measure loading and running procedure
+
+    :return: machine-readable results
+    """
+    rand = random.Random(seed)
+    input_count = procedure.inputs.count()
+
+    def make_inputs():
+        return [rand.uniform(-1.0, 1.0) for _ in range(input_count)]
+
+    # cold load builds everything, warm load is served from cache
+    builder = ProcedureBuilder()
+    with CaptureQueriesContext(connection) as context:
+        start = time.perf_counter()
+        procedure_object, plan = builder.load(procedure)
+        cold_time = time.perf_counter() - start
+    cold_queries = len(context.captured_queries)
+
+    with CaptureQueriesContext(connection) as context:
+        start = time.perf_counter()
+        builder.load_model(procedure)
+        warm_time = time.perf_counter() - start
+    warm_queries = len(context.captured_queries)
+
+    latencies = []
+    for _ in range(repeat):
+        inputs = make_inputs()
+        start = time.perf_counter()
+        run_procedure(procedure_object, inputs, plan=plan)
+        latencies.append(time.perf_counter() - start)
+
+    inputs_list = [make_inputs() for _ in range(batch_size)]
+    start = time.perf_counter()
+    results = run_procedure_batch(procedure_object, plan, inputs_list)
+    batch_time = time.perf_counter() - start
+
+    # memory is traced in separate passes, tracing slows down timed ones
+    tracemalloc.start()
+    ProcedureBuilder().load(procedure)
+    __, load_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    run_procedure_batch(procedure_object, plan, inputs_list)
+    __, batch_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'procedure': {
+            'signature': procedure.signature,
+            'inputs': input_count,
+            'joints': procedure.joints.count(),
+            'steps': len(plan.steps) if plan else None,
+        },
+        'load': {
+            'cold_seconds': cold_time,
+            'cold_queries': cold_queries,
+            'warm_seconds': warm_time,
+            'warm_queries': warm_queries,
+            'peak_memory_bytes': load_memory,
+        },
+        'run': summarize(latencies),
+        'batch': {
+            'size': batch_size,
+            'seconds': batch_time,
+            'runs_per_second': batch_time and batch_size / batch_time,
+            'errors': sum(1 for __, e in results if e),
+            'peak_memory_bytes': batch_memory,
+        },
+    }
+
+
+def benchmark_run_logs(
+        procedure,
+        run_count,
+        user_count=10,
+        pages=20,
+        days=30,
+        seed=0,
+):
+    """
+    seed `run_count` runs of procedure spread over `user_count` users and
+    `days` days, then measure filtered run-log pages of owner of procedure
+    listed by `ProcedureRunLogViewSet`, following cursors of pages
+
+    :return: machine-readable results
+    """
+    rand = random.Random(seed)
+    user_model = apps.get_model('users.User')
+    owner = procedure.site.user
+    user_ids = [owner.id] + [
+        user_model.objects.create(uuid=uuid.uuid4()).id
+        for _ in range(user_count - 1)
+    ]
+
+    start = timezone.now() - datetime.timedelta(days=days)
+    outputs = encode_values([1.0])
+    seed_start = time.perf_counter()
+    for offset in range(0, run_count, 1000):
+        ProcedureRun.objects.bulk_create([
+            ProcedureRun(
+                procedure=procedure,
+                user_id=rand.choice(user_ids),
+                status=rand.choice(['pending', 'finished', 'finished']),
+                finished_time=start + datetime.timedelta(
+                    seconds=rand.uniform(0, days * 86400)),
+                outputs=outputs,
+            ) for _ in range(min(1000, run_count - offset))
+        ])
+    # created_time is set on insert, spread runs over the period
+    ProcedureRun.objects.filter(procedure=procedure).update(
+        created_time=models.F('finished_time'))
+    seed_time = time.perf_counter() - seed_start
+
+    view = ProcedureRunLogViewSet.as_view({'get': 'list'})
+    user = AuthenticatedUser({
+        'uuid': str(owner.uuid),
+        'username': 'benchmark',
+        'scopes': [scope_of_users],
+    }, access_token='benchmark')
+    first_params = {
+        'status': 'finished',
+        'created_time_after': (
+            start + datetime.timedelta(days=days / 4)).isoformat(),
+    }
+
+    params = first_params
+    latencies = []
+    query_counts = []
+    for _ in range(pages):
+        request = test.APIRequestFactory().get('/run-logs/', params)
+        test.force_authenticate(request, user=user, token='benchmark')
+        with CaptureQueriesContext(connection) as context:
+            begin = time.perf_counter()
+            response = view(request)
+            response.render()
+            latencies.append(time.perf_counter() - begin)
+        query_counts.append(len(context.captured_queries))
+        if response.status_code != 200:
+            raise ValueError('failed to list run logs: {}'.format(
+                response.status_code))
+
+        # start over once the last page is read
+        next_url = response.data.get('next')
+        params = dict(urllib.parse.parse_qsl(
+            urllib.parse.urlsplit(next_url).query)) if next_url else \
+            first_params
+
+    return {
+        'runs': run_count,
+        'users': user_count,
+        'seed_seconds': seed_time,
+        'filters': first_params,
+        'pages': summarize(latencies),
+        'queries_per_page': max(query_counts),
+    }
@@ -1,3 +1,9 @@
+import collections
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
 from django.utils.functional import LazyObject
 
 from abei.interfaces import (
@@ -10,8 +16,182 @@ from abei.interfaces import (
     service_entry as _,
 )
 
+from ..editors.signals import procedure_revised
+from ..metrics import default_metric_registry
 from ..settings import default_service_site
 
+from .engines import (
+    PlanError,
+    compile_plan,
+    is_pure_builtin,
+)
+
+default_metric_registry.describe(
+    'procedure_cache_total', 'counter',
+    'lookups of loaded procedures by result',
+)
+default_metric_registry.describe(
+    'procedure_load_seconds', 'histogram',
+    'time taken to load procedures',
+)
+
+
+class ProcedureCache(object):
+    """
+    bounded LRU cache of loaded procedure objects and their plans,
+    keyed by user, site, procedure and revision of the procedure
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(procedure):
+        return (
+            procedure.site.user_id,
+            procedure.site_id,
+            procedure.id,
+            procedure.revision,
+        )
+
+    def get(self, procedure):
+        key = self.make_key(procedure)
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, procedure, value):
+        key = self.make_key(procedure)
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def evict(self, procedure_ids):
+        with self.lock:
+            for key in [k for k in self.entries if k[2] in procedure_ids]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class ProcedureGraph(object):
+    """
+    in-memory snapshot of a procedure and everything it depends on,
+    fetched level by level with a fixed number of queries per level
+    """
+
+    def __init__(self):
+        self.procedures = {}
+        self.loaded = {}
+        self.plans = {}
+        self.inputs = {}
+        self.outputs = {}
+        self.output_links = {}
+        self.joints = {}
+        self.links = {}
+
+    def collect(self, procedure, query=None):
+        """
+        :param procedure: root procedure
+        :param query: callable returning procedure object and plan
+            already loaded, those procedures are not expanded any further
+        """
+        procedure_model = apps.get_model('editors.Procedure')
+
+        pending = [procedure]
+        while pending:
+            self.procedures.update((p.id, p) for p in pending)
+            for p in pending:
+                loaded = query and query(p)
+                if loaded:
+                    self.set_loaded(p, *loaded)
+
+            inner_ids = self.collect_procedures([
+                p.id for p in pending if p.id not in self.loaded
+            ]) - set(self.procedures)
+            pending = list(
+                procedure_model.objects.filter(
+                    id__in=inner_ids,
+                ).select_related('site')
+            ) if inner_ids else []
+
+        return self
+
+    def collect_procedures(self, ids):
+        if not ids:
+            return set()
+
+        for i in apps.get_model('editors.ProcedureInput').objects.filter(
+                procedure_id__in=ids,
+        ).order_by('index'):
+            self.inputs.setdefault(i.procedure_id, []).append(i)
+
+        for o in apps.get_model('editors.ProcedureOutput').objects.filter(
+                procedure_id__in=ids,
+        ).order_by('index'):
+            self.outputs.setdefault(o.procedure_id, []).append(o)
+
+        self.output_links.update(
+            (o.output_id, o) for o in
+            apps.get_model('editors.ProcedureOutputLink').objects.filter(
+                output__procedure_id__in=ids,
+            )
+        )
+
+        joints = list(apps.get_model('editors.ProcedureJoint').objects.filter(
+            outer_procedure_id__in=ids,
+        ))
+        self.joints.update((j.id, j) for j in joints)
+
+        for i in apps.get_model('editors.ProcedureJointLink').objects.filter(
+                joint__outer_procedure_id__in=ids,
+        ).order_by('index'):
+            self.links.setdefault(i.joint_id, []).append(i)
+
+        return set(j.inner_procedure_id for j in joints)
+
+    def get_procedure(self, procedure_id):
+        return self.procedures[procedure_id]
+
+    def get_loaded(self, procedure):
+        return self.loaded.get(procedure.id)
+
+    def set_loaded(self, procedure, procedure_object, plan=None):
+        self.loaded[procedure.id] = procedure_object
+        self.plans[procedure.id] = plan
+
+    def get_plan(self, procedure):
+        return self.plans.get(procedure.id)
+
+    def get_inputs(self, procedure):
+        return self.inputs.get(procedure.id, [])
+
+    def get_outputs(self, procedure):
+        return self.outputs.get(procedure.id, [])
+
+    def get_output_link(self, output):
+        output_link = self.output_links.get(output.id)
+        if not output_link:
+            raise ValueError('output {} of {} is not linked'.format(
+                output.index,
+                self.procedures[output.procedure_id].signature,
+            ))
+        return output_link
+
+    def get_joint(self, joint_id):
+        return self.joints[joint_id]
+
+    def get_links(self, joint):
+        return self.links.get(joint.id, [])
+
 
 class ProcedureBuilder(object):
     def __init__(self):
@@ -24,81 +204,113 @@ class ProcedureBuilder(object):
         self.site_factory = default_service_site.get_service(
             _(IProcedureSiteFactory)
         )
-        self.site_cache = {}
         self.site_default = self.site_factory.create(
             None, builtin=True)
+        self.procedure_cache = ProcedureCache(getattr(
+            settings,
+            'ABEI_API_PROCEDURE_CACHE_SIZE',
+            1024,
+        ))
+        procedure_revised.connect(self.evict_procedures)
 
-    def load_model_site(self, site, clear=False):
-        if clear:
-            self.site_cache.clear()
+    def evict_procedures(self, procedure_ids, **kwargs):
+        self.procedure_cache.evict(procedure_ids)
 
-        site_object = (
-            self.site_cache.get(site.signature)
-            if site else self.site_default
+    def query_model(self, procedure):
+        """
+        :return: procedure object and plan if procedure has been loaded
+        """
+        if procedure.site.signature != 'builtin':
+            entry = self.procedure_cache.get(procedure)
+            default_metric_registry.inc(
+                'procedure_cache_total', result='hit' if entry else 'miss')
+            return entry
+
+        procedure_object = self.site_default.query_procedure(
+            procedure.signature,
+            depth=0,
         )
-        if site_object:
-            return site_object
+        if not procedure_object:
+            raise ValueError('invalid builtin procedure {}'.format(
+                procedure.signature))
+        return procedure_object, None
 
-        site_builtin = bool(site.signature == 'builtin')
-        site_bases = [
-            self.load_model_site(site)
-            for site in site.base_sites.all()
-        ]
-        assert not (site_builtin and site_bases)
+    @staticmethod
+    def is_pure_model(procedure, graph):
+        if procedure.site.signature == 'builtin':
+            return is_pure_builtin(procedure.signature)
 
-        site_object = self.site_factory.create(
-            site_bases,
-            builtin=site_builtin,
-        )
-        self.site_cache[site.signature] = site_object
-        return site_object
+        plan = graph.get_plan(procedure)
+        return bool(plan) and all(s.pure for s in plan.steps)
 
-    def load_model_joint(self, joint, procedure_object):
-        joint_object = self.joint_factory.create(
-            self.load_model(joint.inner_procedure),
+    def load_model_joint(
+            self,
+            joint,
             procedure_object,
-            signature=joint.signature,
-        )
+            joint_objects,
+            graph,
+    ):
+        # joints shared by several links are built only once per load
+        if joint.id in joint_objects:
+            joint_object = joint_objects[joint.id]
+            if not joint_object:
+                raise ValueError('cyclic joint {}'.format(joint.signature))
+            return joint_object
+
+        joint_objects[joint.id] = None
+
         # inputs ----------------------
-        inputs = list(joint.links.order_by('index').all())
+        inputs = graph.get_links(joint)
         input_joints = [
-            i.input_joint and
+            i.input_joint_id and
             self.load_model_joint(
-                i.input_joint,
+                graph.get_joint(i.input_joint_id),
                 procedure_object,
+                joint_objects,
+                graph,
             ) for i in inputs
         ]
         input_indices = [
             i.input_index for i in inputs
         ]
-        joint_object.set_joints(
-            input_joints,
-            input_indices,
+
+        # joints of the same pure procedure reading the same inputs
+        # are merged into one joint
+        inner_procedure = graph.get_procedure(joint.inner_procedure_id)
+        inner_object = self.load_model_graph(inner_procedure, graph)
+        structure = self.is_pure_model(inner_procedure, graph) and (
+            inner_procedure.id,
+            tuple(id(j) if j else None for j in input_joints),
+            tuple(input_indices),
         )
+        joint_object = structure and joint_objects.get(structure)
+        if not joint_object:
+            joint_object = self.joint_factory.create(
+                inner_object,
+                procedure_object,
+                signature=joint.signature,
+            )
+            joint_object.set_joints(
+                input_joints,
+                input_indices,
+            )
+
+        joint_objects[joint.id] = joint_object
+        if structure:
+            joint_objects[structure] = joint_object
         return joint_object
 
-    def load_model(self, procedure, clear=False):
-        site_object = self.load_model_site(
-            procedure.site,
-            clear=clear,
-        )
-        procedure_object = site_object.query_procedure(
-            procedure.signature,
-            depth=0,
-        )
+    def load_model_graph(self, procedure, graph):
+        procedure_object = graph.get_loaded(procedure)
         if procedure_object:
             return procedure_object
 
         # inputs -----------------------
-        inputs = list(
-            procedure.inputs.order_by('index').all()
-        )
+        inputs = graph.get_inputs(procedure)
 
         # outputs ----------------------
-        outputs = list(
-            procedure.outputs.select_related(
-                'output_link').order_by('index').all()
-        )
+        outputs = graph.get_outputs(procedure)
+        output_links = [graph.get_output_link(o) for o in outputs]
 
         procedure_object = self.factory.create(
             'composite',
@@ -114,16 +326,19 @@ class ProcedureBuilder(object):
         )
 
         # joints ----------------------
+        joint_objects = {}
         output_joints = [
-            o.output_link.output_joint and
+            o.output_joint_id and
             self.load_model_joint(
-                o.output_link.output_joint,
+                graph.get_joint(o.output_joint_id),
                 procedure_object,
-            ) for o in outputs
+                joint_objects,
+                graph,
+            ) for o in output_links
         ]
 
         output_indices = [
-            o.output_link.output_index for o in outputs
+            o.output_index for o in output_links
         ]
 
         procedure_object.set_joints(
@@ -131,10 +346,37 @@ class ProcedureBuilder(object):
             output_indices,
         )
 
-        # register to site ----------------
-        site_object.register_procedure(procedure_object)
+        # plan ----------------------------
+        try:
+            plan = compile_plan(procedure, graph)
+        except PlanError:
+            plan = None
+
+        # register to cache ----------------
+        graph.set_loaded(procedure, procedure_object, plan)
+        self.procedure_cache.set(procedure, (procedure_object, plan))
         return procedure_object
 
+    def load(self, procedure, clear=False):
+        if clear:
+            self.procedure_cache.clear()
+
+        start = time.perf_counter()
+        graph = ProcedureGraph().collect(procedure, query=self.query_model)
+        loaded = (
+            self.load_model_graph(procedure, graph),
+            graph.get_plan(procedure),
+        )
+        default_metric_registry.observe(
+            'procedure_load_seconds', time.perf_counter() - start)
+        return loaded
+
+    def load_model(self, procedure, clear=False):
+        return self.load(procedure, clear=clear)[0]
+
+    def load_plan(self, procedure, clear=False):
+        return self.load(procedure, clear=clear)[1]
+
 
 class DefaultProcedureBuilder(LazyObject):
 
@@ -0,0 +1,123 @@
+import collections
+import hashlib
+import json
+import logging
+import threading
+
+from abei.interfaces import (
+    IStorage,
+    service_entry as _,
+)
+from django.conf import settings
+from django.utils.functional import LazyObject
+
+from ..editors.signals import procedure_revised
+from ..settings import default_service_site
+
+logger = logging.getLogger(__name__)
+
+
+class ProcedureResultCache(object):
+    """
+    memoize outputs of procedure runs, keyed by procedure, revision of
+    procedure and inputs. entries are kept in a bounded LRU of current
+    process, and optionally shared with other processes through storage
+    """
+
+    def __init__(
+            self,
+            max_size,
+            storage=None,
+            prefix='procedure-result',
+            enabled=True,
+    ):
+        self.enabled = enabled
+        self.max_size = max_size
+        self.storage = storage
+        self.prefix = prefix
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        procedure_revised.connect(self.evict_procedures)
+
+    def make_key(self, procedure, inputs):
+        digest = hashlib.sha256(json.dumps(
+            inputs,
+            sort_keys=True,
+            separators=(',', ':'),
+        ).encode()).hexdigest()
+        return '{}:{}:{}:{}'.format(
+            self.prefix,
+            procedure.id,
+            procedure.revision,
+            digest,
+        )
+
+    def get(self, procedure, inputs):
+        key = self.make_key(procedure, inputs)
+        with self.lock:
+            outputs = self.entries.get(key)
+            if outputs is not None:
+                self.entries.move_to_end(key)
+                return outputs
+
+        outputs = self.get_shared(key)
+        if outputs is not None:
+            self.set_local(key, procedure, outputs)
+        return outputs
+
+    def set(self, procedure, inputs, outputs):
+        key = self.make_key(procedure, inputs)
+        self.set_local(key, procedure, outputs)
+        self.set_shared(key, outputs)
+
+    def set_local(self, key, procedure, outputs):
+        with self.lock:
+            self.entries[key] = outputs
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def get_shared(self, key):
+        if not self.storage:
+            return None
+
+        try:
+            value = self.storage.get_value(key)
+            return value and json.loads(value)
+        except Exception as e:
+            logger.warning('failed to get result from storage: %s', e)
+            return None
+
+    def set_shared(self, key, outputs):
+        if not self.storage:
+            return
+
+        try:
+            self.storage.set_value(key, json.dumps(outputs))
+        except Exception as e:
+            logger.warning('failed to set result to storage: %s', e)
+
+    def evict_procedures(self, procedure_ids, **kwargs):
+        # entries shared through storage are keyed by revision,
+        # they simply become unreachable once procedure is revised
+        prefixes = tuple(
+            '{}:{}:'.format(self.prefix, i) for i in procedure_ids)
+        with self.lock:
+            for key in [k for k in self.entries if k.startswith(prefixes)]:
+                del self.entries[key]
+
+
+class DefaultProcedureResultCache(LazyObject):
+
+    def _setup(self):
+        config = getattr(settings, 'ABEI_API_RUN_CACHE', {})
+        storage_name = config.get('STORAGE')
+        self._wrapped = ProcedureResultCache(
+            max_size=config.get('MAX_SIZE', 4096),
+            storage=storage_name and default_service_site.get_service(
+                _(IStorage, storage_name)),
+            enabled=config.get('ENABLED', False),
+        )
+
+
+default_procedure_result_cache = DefaultProcedureResultCache()
@@ -0,0 +1,45 @@
+import json
+import struct
+
+FLOAT64 = b'd'
+JSON = b'j'
+
+
+def encode_values(values):
+    """
+    encode list of run inputs or outputs to bytes, lists of floats are
+    packed as little-endian float64, anything else is stored as json
+
+    :return: encoded bytes, or None if values is None
+    """
+    if values is None:
+        return None
+
+    if all(type(v) is float for v in values):
+        return FLOAT64 + struct.pack('<{}d'.format(len(values)), *values)
+
+    return JSON + json.dumps(values).encode('utf-8')
+
+
+def decode_values(data):
+    """
+    decode bytes produced by encode_values
+
+    :return: list of values, or None if data is empty or malformed
+    """
+    if not data:
+        return None
+
+    data = bytes(data)
+    tag, payload = data[:1], data[1:]
+    try:
+        if tag == FLOAT64:
+            return list(struct.unpack(
+                '<{}d'.format(len(payload) // 8), payload))
+        if tag == JSON:
+            values = json.loads(payload.decode('utf-8'))
+            return values if isinstance(values, list) else None
+    except (ValueError, struct.error):
+        pass
+
+    return None
@@ -0,0 +1,84 @@
+import logging
+import threading
+from concurrent import futures
+
+from django import db
+from django.conf import settings
+from django.utils.functional import LazyObject
+
+from .tasks import (
+    execute_procedure_run,
+    load_and_run_procedure,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ProcedureRunDispatcher(object):
+    """
+    dispatch pending procedure runs to a pool of workers,
+    supported modes are:
+        thread: run on a pool of threads of current process
+        process: run on a pool of forked processes
+        inline: run immediately in the calling thread
+        database: leave runs pending, to be claimed by `run_workers`
+    """
+
+    def __init__(self, mode='thread', max_workers=4):
+        assert mode in ['thread', 'process', 'inline', 'database']
+        self.mode = mode
+        self.max_workers = max_workers
+        self.executor = None
+        self.lock = threading.Lock()
+        self.queue_depth = 0
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor:
+                return self.executor
+
+            if self.mode == 'process':
+                # forked workers must not share connections with us
+                db.connections.close_all()
+                self.executor = futures.ProcessPoolExecutor(
+                    max_workers=self.max_workers)
+            else:
+                self.executor = futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers)
+            return self.executor
+
+    def dispatch(self, run_uuid):
+        if self.mode == 'database':
+            return
+
+        if self.mode == 'inline':
+            load_and_run_procedure(run_uuid)
+            return
+
+        with self.lock:
+            self.queue_depth += 1
+
+        future = self.get_executor().submit(
+            execute_procedure_run, run_uuid)
+        future.add_done_callback(self.on_done)
+
+    def on_done(self, future):
+        with self.lock:
+            self.queue_depth -= 1
+
+        if future.exception():
+            logger.error(
+                'failed to execute procedure run: %s', future.exception())
+
+
+class DefaultProcedureRunDispatcher(LazyObject):
+
+    def _setup(self):
+        config = getattr(settings, 'ABEI_API_RUN_DISPATCHER', {})
+        self._wrapped = ProcedureRunDispatcher(
+            mode=config.get('MODE', 'thread'),
+            max_workers=config.get('MAX_WORKERS', 4),
+        )
+
+
+default_procedure_run_dispatcher = DefaultProcedureRunDispatcher()
@@ -0,0 +1,319 @@
+import collections
+import time
+
+from django.conf import settings
+
+try:
+    import numpy
+except ImportError:  # vectorized engine is optional
+    numpy = None
+
+ProcedureStep = collections.namedtuple('ProcedureStep', [
+    'signature',
+    'procedure_object',
+    'input_slots',
+    'output_slots',
+    'pure',
+    'joint',
+])
+
+
+def is_pure_builtin(signature):
+    """
+    builtin procedures are pure, whose outputs only depend on inputs,
+    unless listed in ABEI_API_IMPURE_PROCEDURES
+    """
+    return signature not in getattr(
+        settings, 'ABEI_API_IMPURE_PROCEDURES', [])
+
+
+class PlanError(Exception):
+    """
+    raised when a procedure can not be compiled into plan
+    """
+
+
+class ProcedurePlan(object):
+    """
+    composite procedure compiled into a flat list of topologically ordered
+    steps of builtin procedures, values are addressed by slots: slots of
+    procedure inputs come first, followed by slots of outputs of each step
+    """
+
+    def __init__(
+            self,
+            input_signatures,
+            steps,
+            output_slots,
+            slot_count,
+    ):
+        self.input_signatures = input_signatures
+        self.steps = steps
+        self.output_slots = output_slots
+        self.slot_count = slot_count
+
+
+class PlanProcedure(object):
+    """
+    plan of composite procedure called as one step of outer plans, for
+    plans too large to be inlined
+    """
+
+    def __init__(self, plan):
+        self.plan = plan
+
+    def run(self, inputs):
+        return run_plan(self.plan, inputs)
+
+
+def compile_plan(procedure, graph):
+    """
+    compile procedure of graph into plan, joints referring to builtin
+    procedures become steps, while joints referring to composite
+    procedures are replaced by steps of plans of those procedures.
+    plans of more than ABEI_API_PLAN_INLINE_STEPS steps are called as one
+    step instead, so plans of composites reusing composites several times
+    do not grow exponentially with depth.
+    pure steps of the same procedure reading the same slots are merged
+    """
+    max_inline_steps = getattr(settings, 'ABEI_API_PLAN_INLINE_STEPS', 64)
+    inputs = graph.get_inputs(procedure)
+    output_links = [
+        graph.get_output_link(o) for o in graph.get_outputs(procedure)
+    ]
+
+    steps = []
+    slot_count = len(inputs)
+    joint_slots = {}
+
+    def resolve(joint_id, index):
+        if not joint_id:
+            if index >= len(inputs):
+                raise PlanError('invalid input index {}'.format(index))
+            return index
+
+        slots = joint_slots[joint_id]
+        if index >= len(slots):
+            raise PlanError('invalid output index {} of {}'.format(
+                index, graph.get_joint(joint_id).signature))
+        return slots[index]
+
+    def allocate(count):
+        nonlocal slot_count
+        slot_count += count
+        return list(range(slot_count - count, slot_count))
+
+    merged_steps = {}
+
+    def emit(step):
+        key = step.pure and (step.signature, tuple(step.input_slots))
+        if key in merged_steps:
+            return merged_steps[key]
+
+        step = step._replace(output_slots=allocate(len(step.output_slots)))
+        steps.append(step)
+        if key:
+            merged_steps[key] = step.output_slots
+        return step.output_slots
+
+    def inline(inner_plan, input_slots, joint_signature):
+        slots = input_slots + [None] * (
+            inner_plan.slot_count - len(input_slots))
+        for step in inner_plan.steps:
+            output_slots = emit(step._replace(
+                input_slots=[slots[i] for i in step.input_slots],
+                joint='{}/{}'.format(joint_signature, step.joint),
+            ))
+            for i, j in zip(step.output_slots, output_slots):
+                slots[i] = j
+
+        return [slots[i] for i in inner_plan.output_slots]
+
+    # depth first, each joint is appended once all its inputs are
+    visiting = set()
+    stack = [o.output_joint_id for o in output_links if o.output_joint_id]
+    while stack:
+        joint_id = stack[-1]
+        if joint_id in joint_slots:
+            stack.pop()
+            continue
+
+        joint = graph.get_joint(joint_id)
+        links = graph.get_links(joint)
+        missing = [
+            i.input_joint_id for i in links
+            if i.input_joint_id and i.input_joint_id not in joint_slots
+        ]
+        if missing:
+            if joint_id in visiting:
+                raise PlanError('cyclic joint {}'.format(joint.signature))
+            visiting.add(joint_id)
+            stack.extend(missing)
+            continue
+
+        stack.pop()
+        input_slots = [resolve(i.input_joint_id, i.input_index) for i in links]
+        inner_procedure = graph.get_procedure(joint.inner_procedure_id)
+        if inner_procedure.site.signature != 'builtin':
+            inner_plan = graph.get_plan(inner_procedure)
+            if not inner_plan:
+                raise PlanError('procedure {} is not compiled'.format(
+                    inner_procedure.signature))
+
+            if len(input_slots) != len(inner_plan.input_signatures):
+                raise PlanError('invalid inputs of {}'.format(
+                    joint.signature))
+
+            if len(inner_plan.steps) <= max_inline_steps:
+                joint_slots[joint_id] = inline(
+                    inner_plan, input_slots, joint.signature)
+                continue
+
+            # named by site too, composites of different sites may share
+            # signatures
+            joint_slots[joint_id] = emit(ProcedureStep(
+                '{}/{}'.format(
+                    inner_procedure.site.signature,
+                    inner_procedure.signature,
+                ),
+                PlanProcedure(inner_plan),
+                input_slots,
+                [None] * len(inner_plan.output_slots),
+                all(s.pure for s in inner_plan.steps),
+                joint.signature,
+            ))
+            continue
+
+        inner_object = graph.get_loaded(inner_procedure)
+        if len(input_slots) != len(inner_object.get_input_signatures()):
+            raise PlanError('invalid inputs of {}'.format(joint.signature))
+
+        joint_slots[joint_id] = emit(ProcedureStep(
+            inner_procedure.signature,
+            inner_object,
+            input_slots,
+            [None] * len(inner_object.get_output_signatures()),
+            is_pure_builtin(inner_procedure.signature),
+            joint.signature,
+        ))
+
+    return ProcedurePlan(
+        [i.signature for i in inputs],
+        steps,
+        [resolve(o.output_joint_id, o.output_index) for o in output_links],
+        slot_count,
+    )
+
+
+def run_plan(plan, inputs, timings=None):
+    """
+    run plan against procedure data of inputs, steps are executed in
+    order without recursion, their outputs are kept in registers.
+    outputs of pure steps are memoized by input values during the run
+
+    :param plan: compiled plan
+    :param inputs: procedure data of inputs
+    :param timings: list to append (step, seconds) of each step to
+    :return: procedure data of outputs
+    """
+    memo = {}
+    registers = [None] * plan.slot_count
+    registers[:len(inputs)] = inputs
+    for step in plan.steps:
+        start = timings is not None and time.perf_counter()
+        step_inputs = [registers[i] for i in step.input_slots]
+        key = step.pure and make_memo_key(step, step_inputs)
+        outputs = memo.get(key) if key else None
+        if outputs is None:
+            outputs = step.procedure_object.run(step_inputs)
+            if key:
+                memo[key] = outputs
+        if timings is not None:
+            timings.append((step, time.perf_counter() - start))
+
+        for i, o in zip(step.output_slots, outputs):
+            registers[i] = o
+
+    return [registers[i] for i in plan.output_slots]
+
+
+def make_memo_key(step, step_inputs):
+    key = (step.signature, tuple(
+        (type(v), v) for v in (i.get_value() for i in step_inputs)
+    ))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+# builtin procedures with their numpy equivalents
+vectorized_procedures = numpy and {
+    'float-add': numpy.add,
+    'float-sub': numpy.subtract,
+    'float-mul': numpy.multiply,
+    'float-div': numpy.true_divide,
+    'float-mod': numpy.mod,
+    'float-pow': numpy.power,
+    'float-neg': numpy.negative,
+} or {}
+
+
+def is_vectorizable(plan):
+    return bool(
+        numpy and plan and
+        all(sig == 'float' for sig in plan.input_signatures) and
+        all(
+            s.signature in vectorized_procedures and
+            len(s.output_slots) == 1
+            for s in plan.steps
+        )
+    )
+
+
+def are_vectorizable_inputs(plan, inputs_list):
+    """
+    :return: True if every input vector holds only floats, other values
+        such as ints, bools or numeric strings, which numpy would convert
+        silently, are left to data builders of procedure by running
+        vectors one by one
+    """
+    return all(
+        isinstance(i, (list, tuple)) and
+        len(i) == len(plan.input_signatures) and
+        all(type(v) is float for v in i)
+        for i in inputs_list
+    )
+
+
+def run_plan_vectorized(plan, inputs_list):
+    """
+    run plan against many input vectors at once, every builtin step is
+    evaluated as a numpy operation over the whole column of values
+
+    :param plan: plan passing `is_vectorizable`
+    :param inputs_list: input vectors
+    :return: output vectors
+    :raise FloatingPointError: if any of the step is not well-defined
+        for some of the vectors, run those vectors one by one instead
+    """
+    columns = numpy.array(
+        inputs_list,
+        dtype=numpy.float64,
+    ).reshape(len(inputs_list), len(plan.input_signatures)).T
+
+    if not plan.output_slots:
+        return [[] for _ in inputs_list]
+
+    registers = [None] * plan.slot_count
+    registers[:len(columns)] = columns
+    with numpy.errstate(all='raise'):
+        for step in plan.steps:
+            registers[step.output_slots[0]] = vectorized_procedures[
+                step.signature](*[registers[i] for i in step.input_slots])
+
+    return numpy.array([
+        numpy.broadcast_to(registers[i], len(inputs_list))
+        for i in plan.output_slots
+    ]).T.tolist()
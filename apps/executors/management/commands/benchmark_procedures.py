@@ -0,0 +1,185 @@
+import json
+import math
+import platform
+import uuid
+
+from django.apps import apps
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import (
+    connection,
+    transaction,
+)
+from django.utils import timezone
+
+from ....editors.utils import init_sites
+from ...benchmarks import (
+    benchmark_procedure,
+    benchmark_run_logs,
+    create_benchmark_procedure,
+)
+
+
+class Command(BaseCommand):
+    help = 'benchmark loading and running of a synthetic procedure'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--depth',
+            type=int,
+            default=10,
+            help='number of joint layers',
+        )
+        parser.add_argument(
+            '--width',
+            type=int,
+            default=4,
+            help='number of inputs, outputs and joints of each layer',
+        )
+        parser.add_argument(
+            '--fan-in',
+            type=int,
+            default=2,
+            help='number of values read by each joint',
+        )
+        parser.add_argument(
+            '--diamond-density',
+            type=float,
+            default=0.5,
+            help='probability a joint reads two joints of previous layer',
+        )
+        parser.add_argument(
+            '--joints',
+            type=int,
+            default=None,
+            help='number of joints, overrides depth',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=100,
+            help='number of timed single runs',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='number of input vectors of timed batch run',
+        )
+        parser.add_argument(
+            '--run-logs',
+            type=int,
+            default=0,
+            help='number of runs seeded to time filtered run-log pages, '
+                 '0 skips run logs',
+        )
+        parser.add_argument(
+            '--run-log-users',
+            type=int,
+            default=10,
+            help='number of users seeded runs are spread over',
+        )
+        parser.add_argument(
+            '--run-log-pages',
+            type=int,
+            default=20,
+            help='number of timed run-log pages',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='seed of generated procedure and inputs',
+        )
+        parser.add_argument(
+            '--output',
+            default='-',
+            help='file to write json results to, - for stdout',
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='keep generated user, sites and procedure',
+        )
+
+    def handle(self, *args, **options):
+        width = options['width']
+        fan_in = options['fan_in']
+        depth = options['depth']
+        if options['joints']:
+            depth = math.ceil(options['joints'] / max(width, 1))
+        if width < 1 or fan_in < 2 or depth < 1 or options['repeat'] < 1 or \
+                options['batch_size'] < 1 or options['run_logs'] < 0 or \
+                options['run_log_users'] < 1 or \
+                options['run_log_pages'] < 1 or \
+                not 0 <= options['diamond_density'] <= 1:
+            raise CommandError('invalid procedure shape')
+
+        with transaction.atomic():
+            user = apps.get_model('users.User').objects.create(
+                uuid=uuid.uuid4())
+            init_sites()
+
+            site_model = apps.get_model('editors.ProcedureSite')
+            site = site_model.objects.create(
+                signature='benchmark',
+                user=user,
+            )
+            site.base_sites.add(site_model.objects.get(
+                signature='builtin',
+                user=None,
+            ))
+
+            procedure = create_benchmark_procedure(
+                site,
+                'benchmark-{}x{}x{}'.format(depth, width, fan_in),
+                depth=depth,
+                width=width,
+                fan_in=fan_in,
+                diamond_density=options['diamond_density'],
+                seed=options['seed'],
+            )
+            results = benchmark_procedure(
+                procedure,
+                repeat=options['repeat'],
+                batch_size=options['batch_size'],
+                seed=options['seed'],
+            )
+            if options['run_logs']:
+                results['run_logs'] = benchmark_run_logs(
+                    procedure,
+                    options['run_logs'],
+                    user_count=options['run_log_users'],
+                    pages=options['run_log_pages'],
+                    seed=options['seed'],
+                )
+
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        results.update(
+            config={
+                'depth': depth,
+                'width': width,
+                'fan_in': fan_in,
+                'diamond_density': options['diamond_density'],
+                'repeat': options['repeat'],
+                'batch_size': options['batch_size'],
+                'run_logs': options['run_logs'],
+                'seed': options['seed'],
+            },
+            environment={
+                'time': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+            },
+        )
+
+        content = json.dumps(results, indent=2, sort_keys=True)
+        if options['output'] == '-':
+            self.stdout.write(content)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(content + '\n')
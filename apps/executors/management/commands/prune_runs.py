@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+
+from ...archives import (
+    default_procedure_run_archive,
+    prune_procedure_runs,
+)
+
+
+class Command(BaseCommand):
+    help = 'delete finished procedure runs older than retention period'
+
+    def add_arguments(self, parser):
+        config = getattr(settings, 'ABEI_API_RUN_RETENTION', {})
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=config.get('DAYS'),
+            help='number of days finished runs are kept',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=config.get('BATCH_SIZE', 1000),
+            help='number of runs deleted in one transaction',
+        )
+        parser.add_argument(
+            '--no-archive',
+            action='store_false',
+            dest='archive',
+            default=config.get('ARCHIVE', True),
+            help='delete runs without archiving them',
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] is None:
+            raise CommandError('retention period is not configured')
+        if options['days'] < 0 or options['batch_size'] < 1:
+            raise CommandError('invalid retention period or batch size')
+
+        pruned = prune_procedure_runs(
+            options['days'],
+            archive=options['archive'] and default_procedure_run_archive,
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write('{} runs pruned'.format(pruned))
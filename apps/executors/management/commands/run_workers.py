@@ -0,0 +1,69 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...workers import ProcedureRunWorker
+
+
+class Command(BaseCommand):
+    help = 'claim pending procedure runs from database and execute them'
+
+    def add_arguments(self, parser):
+        config = getattr(settings, 'ABEI_API_RUN_WORKERS', {})
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=config.get('CONCURRENCY', 1),
+            help='number of worker threads',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=config.get('BATCH_SIZE', 1),
+            help='number of runs claimed by a worker at a time',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=config.get('POLL_INTERVAL', 1.0),
+            help='seconds to wait when there is no run to claim',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='exit once there is no run to claim',
+        )
+
+    def handle(self, *args, **options):
+        worker = ProcedureRunWorker(
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+        )
+
+        if options['once']:
+            while worker.run_once():
+                pass
+            return
+
+        stop_event = threading.Event()
+        for s in [signal.SIGINT, signal.SIGTERM]:
+            signal.signal(s, lambda *_: stop_event.set())
+
+        threads = [
+            threading.Thread(
+                target=worker.run_forever,
+                args=(stop_event,),
+                daemon=True,
+            ) for _ in range(options['concurrency'])
+        ]
+        for t in threads:
+            t.start()
+
+        self.stdout.write('{} workers started'.format(len(threads)))
+        while not stop_event.wait(1):
+            pass
+
+        for t in threads:
+            t.join()
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.8 on 2026-10-18 14:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('executors', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='procedurerun',
+            name='inputs',
+            field=models.TextField(
+                default=None,
+                null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.8 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('executors', '0002_procedurerun_inputs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='procedurerun',
+            name='lease_time',
+            field=models.DateTimeField(
+                default=None,
+                null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 2.2.8 on 2026-10-18 14:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_procedure_users(apps, schema_editor):
+    procedure_model = apps.get_model('editors', 'Procedure')
+    run_model = apps.get_model('executors', 'ProcedureRun')
+    run_model.objects.filter(user__isnull=True).update(
+        user_id=models.Subquery(
+            procedure_model.objects.filter(
+                id=models.OuterRef('procedure_id'),
+            ).values('site__user_id')[:1]
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('users', '0001_initial'),
+        ('editors', '0002_procedure_revision'),
+        ('executors', '0003_procedurerun_lease_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='procedurerun',
+            name='user',
+            field=models.ForeignKey(
+                db_constraint=False,
+                default=None,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name='runs',
+                to='users.User'
+            ),
+        ),
+        migrations.RunPython(
+            copy_procedure_users,
+            migrations.RunPython.noop,
+        ),
+        migrations.AddIndex(
+            model_name='procedurerun',
+            index=models.Index(
+                fields=['user', 'created_time', 'id'],
+                name='run_user_created_idx'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='procedurerun',
+            index=models.Index(
+                fields=['procedure', 'created_time'],
+                name='run_procedure_created_idx'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='procedurerun',
+            index=models.Index(
+                fields=['status', 'created_time'],
+                name='run_status_created_idx'
+            ),
+        ),
+    ]
@@ -0,0 +1,137 @@
+# Generated by Django 2.2.8 on 2026-10-18 15:02
+
+import json
+import struct
+
+from django.db import migrations, models
+
+FLOAT64 = b'd'
+JSON = b'j'
+
+
+# copies of apps.executors.codecs as of this migration, later changes
+# of the codec must not change how existing rows were converted
+def encode_values(values):
+    if values is None:
+        return None
+
+    if all(type(v) is float for v in values):
+        return FLOAT64 + struct.pack('<{}d'.format(len(values)), *values)
+
+    return JSON + json.dumps(values).encode('utf-8')
+
+
+def decode_values(data):
+    if not data:
+        return None
+
+    data = bytes(data)
+    tag, payload = data[:1], data[1:]
+    try:
+        if tag == FLOAT64:
+            return list(struct.unpack(
+                '<{}d'.format(len(payload) // 8), payload))
+        if tag == JSON:
+            values = json.loads(payload.decode('utf-8'))
+            return values if isinstance(values, list) else None
+    except (ValueError, struct.error):
+        pass
+
+    return None
+
+
+def convert_values(apps, convert, source, target):
+    run_model = apps.get_model('executors', 'ProcedureRun')
+    runs = []
+    for run_id, inputs, outputs in run_model.objects.values_list(
+            'id',
+            'inputs_' + source,
+            'outputs_' + source,
+    ).iterator(chunk_size=1000):
+        runs.append(run_model(id=run_id, **{
+            'inputs_' + target: convert(inputs),
+            'outputs_' + target: convert(outputs),
+        }))
+        if len(runs) >= 1000:
+            run_model.objects.bulk_update(
+                runs, ['inputs_' + target, 'outputs_' + target])
+            runs = []
+
+    if runs:
+        run_model.objects.bulk_update(
+            runs, ['inputs_' + target, 'outputs_' + target])
+
+
+def encode_text(text):
+    try:
+        values = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    return encode_values(values if isinstance(values, list) else None)
+
+
+def decode_binary(data):
+    values = decode_values(data)
+    return None if values is None else json.dumps(values)
+
+
+def forwards(apps, schema_editor):
+    convert_values(apps, encode_text, 'text', 'binary')
+
+
+def backwards(apps, schema_editor):
+    convert_values(apps, decode_binary, 'binary', 'text')
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('executors', '0004_procedurerun_user'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='procedurerun',
+            old_name='inputs',
+            new_name='inputs_text',
+        ),
+        migrations.RenameField(
+            model_name='procedurerun',
+            old_name='outputs',
+            new_name='outputs_text',
+        ),
+        migrations.AddField(
+            model_name='procedurerun',
+            name='inputs_binary',
+            field=models.BinaryField(
+                default=None,
+                null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name='procedurerun',
+            name='outputs_binary',
+            field=models.BinaryField(
+                default=None,
+                null=True
+            ),
+        ),
+        migrations.RunPython(forwards, backwards),
+        migrations.RemoveField(
+            model_name='procedurerun',
+            name='inputs_text',
+        ),
+        migrations.RemoveField(
+            model_name='procedurerun',
+            name='outputs_text',
+        ),
+        migrations.RenameField(
+            model_name='procedurerun',
+            old_name='inputs_binary',
+            new_name='inputs',
+        ),
+        migrations.RenameField(
+            model_name='procedurerun',
+            old_name='outputs_binary',
+            new_name='outputs',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.8 on 2026-10-18 14:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('executors', '0005_procedurerun_binary_values'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='procedurerun',
+            name='elapsed_time',
+            field=models.FloatField(
+                default=None,
+                null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name='procedurerun',
+            name='profile',
+            field=models.TextField(
+                default=None,
+                null=True
+            ),
+        ),
+    ]
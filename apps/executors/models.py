@@ -14,6 +14,15 @@ class ProcedureRun(models.Model):
         on_delete=models.CASCADE,
         db_constraint=False,
     )
+    # owner of procedure, copied to scope runs without joining sites
+    user = models.ForeignKey(
+        'users.User',
+        related_name='runs',
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        null=True,
+        default=None,
+    )
     status_enum = [
         ('pending', 'Pending'),
         ('running', 'Running'),
@@ -31,7 +40,16 @@ class ProcedureRun(models.Model):
         null=True,
         default=None,
     )
-    outputs = models.TextField(
+    lease_time = models.DateTimeField(
+        null=True,
+        default=None,
+    )
+    # encoded by codecs.encode_values
+    inputs = models.BinaryField(
+        null=True,
+        default=None,
+    )
+    outputs = models.BinaryField(
         null=True,
         default=None,
     )
@@ -39,3 +57,29 @@ class ProcedureRun(models.Model):
         null=True,
         default=None,
     )
+    # seconds taken to load and run procedure
+    elapsed_time = models.FloatField(
+        null=True,
+        default=None,
+    )
+    # json timing breakdown of profiled runs
+    profile = models.TextField(
+        null=True,
+        default=None,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user', 'created_time', 'id'],
+                name='run_user_created_idx',
+            ),
+            models.Index(
+                fields=['procedure', 'created_time'],
+                name='run_procedure_created_idx',
+            ),
+            models.Index(
+                fields=['status', 'created_time'],
+                name='run_status_created_idx',
+            ),
+        ]
@@ -0,0 +1,10 @@
+from mb_drf_extensions import pagination
+
+
+class ProcedureRunCursorPagination(pagination.CursorPagination):
+    """
+    keyset pagination of runs, newest first, pages never count or skip
+    rows and id breaks ties between runs created at the same time
+    """
+    ordering = ('-created_time', '-id')
+    page_size_query_param = 'limit'
@@ -0,0 +1,16 @@
+import json
+
+from rest_framework import renderers
+
+
+class EventStreamRenderer(renderers.BaseRenderer):
+    """
+    accept server-sent event requests, events are streamed by views
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # errors raised before streaming are sent as a single event
+        return 'event: error\ndata: {}\n\n'.format(json.dumps(data))
@@ -1,18 +1,31 @@
 import json
+import time
 
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from rest_framework import (
     # exceptions,
     serializers,
 )
 
+from .codecs import (
+    decode_values,
+    encode_values,
+)
+from .dispatchers import (
+    default_procedure_run_dispatcher,
+)
 from .models import (
     ProcedureRun,
 )
 from .tasks import (
     load_procedure,
     # load_and_run_procedure,
-    run_procedure,
+    load_and_run_procedure_cached,
+    load_and_run_procedure_profiled,
+    observe_procedure_run,
+    run_procedure_batch,
 )
 
 
@@ -39,12 +52,8 @@ class ProcedureRunSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_outputs(instance):
-        try:
-            outputs = json.loads(instance.outputs)
-            assert isinstance(outputs, (list, tuple))
-            return outputs
-        except (ValueError, KeyError, AssertionError):
-            return None
+        # decoded only when rendered, packed floats skip json parsing
+        return decode_values(instance.outputs)
 
 
 class ProcedureRunLogSerializer(ProcedureRunSerializer):
@@ -77,28 +86,137 @@ class ProcedureRunCreateSerializer(ProcedureRunSerializer):
             *ProcedureRunSerializer.Meta.fields,
         ]
 
+    def create(self, validated_data):
+        validated_data.setdefault(
+            'user_id', validated_data['procedure'].site.user_id)
+        return super().create(validated_data)
+
 
 class ProcedureRunCreateSyncSerializer(ProcedureRunCreateSerializer):
+    cache = serializers.SerializerMethodField()
+    profile = serializers.SerializerMethodField()
+
+    class Meta(ProcedureRunCreateSerializer.Meta):
+        fields = [
+            *ProcedureRunCreateSerializer.Meta.fields,
+            'cache',
+            'profile',
+        ]
+
+    @staticmethod
+    def get_cache(instance):
+        return getattr(instance, 'cache', None)
+
+    @staticmethod
+    def get_profile(instance):
+        return instance.profile and json.loads(instance.profile)
+
+    def is_profiled(self):
+        request = self.context.get('request')
+        return bool(request) and request.query_params.get(
+            'profile') in ['1', 'true']
 
     def create(self, validated_data):
-        outputs = run_procedure(
-            load_procedure(validated_data['procedure']),
-            validated_data.pop('inputs', []),
-        )
-        outputs = [o.get_value() for o in outputs]
+        inputs = validated_data.pop('inputs', [])
+        start = time.perf_counter()
+        if self.is_profiled():
+            # profiled runs always execute, result cache is bypassed
+            cache = None
+            outputs, profile = load_and_run_procedure_profiled(
+                validated_data['procedure'], inputs)
+        else:
+            profile = None
+            outputs, cache = load_and_run_procedure_cached(
+                validated_data['procedure'], inputs)
+
+        # cache hits did not run the procedure, timing them would skew
+        # run statistics towards lookups
+        elapsed_time = None
+        if cache != 'hit':
+            elapsed_time = time.perf_counter() - start
+            observe_procedure_run(elapsed_time)
         validated_data.update(
             status='finished',
+            inputs=encode_values(inputs),
             finished_time=timezone.now(),
-            outputs=json.dumps(outputs),
+            elapsed_time=elapsed_time,
+            outputs=encode_values(outputs),
+            profile=profile and json.dumps(profile),
         )
-        return super().create(validated_data)
+        instance = super().create(validated_data)
+        instance.cache = cache
+        return instance
 
 
 class ProcedureRunCreateASyncSerializer(ProcedureRunCreateSerializer):
 
     def create(self, validated_data):
-        raise NotImplementedError
-        # inputs = validated_data.pop('inputs', [])
-        # instance = super().create(validated_data)
-        #
-        # return instance
+        validated_data.update(
+            status='pending',
+            inputs=encode_values(validated_data.pop('inputs', [])),
+        )
+        instance = super().create(validated_data)
+
+        # dispatch only after the run is visible to workers
+        transaction.on_commit(
+            lambda: default_procedure_run_dispatcher.dispatch(
+                instance.uuid))
+        return instance
+
+
+class ProcedureRunResultSerializer(ProcedureRunSerializer):
+    class Meta(ProcedureRunSerializer.Meta):
+        fields = [
+            *ProcedureRunSerializer.Meta.fields,
+            'errors',
+        ]
+
+
+class ProcedureRunCreateBatchSerializer(serializers.Serializer):
+    inputs = serializers.ListField(
+        child=serializers.ListField(),
+        write_only=True,
+        allow_empty=False,
+        max_length=getattr(
+            settings, 'ABEI_API_RUN_BATCH', {}).get('MAX_SIZE', 10000),
+    )
+    runs = ProcedureRunResultSerializer(
+        many=True,
+        read_only=True,
+    )
+
+    def create(self, validated_data):
+        # procedure is loaded only once for all input vectors
+        procedure = validated_data['procedure']
+        user_id = validated_data.get('user_id', procedure.site.user_id)
+        procedure_object, plan = load_procedure(procedure, with_plan=True)
+        results = run_procedure_batch(
+            procedure_object,
+            plan,
+            validated_data['inputs'],
+        )
+
+        finished_time = timezone.now()
+        runs = [
+            ProcedureRun(
+                procedure=procedure,
+                user_id=user_id,
+                status='finished',
+                finished_time=finished_time,
+                inputs=encode_values(inputs),
+                outputs=encode_values(outputs),
+                errors=errors,
+            ) for inputs, (outputs, errors) in zip(
+                validated_data['inputs'], results)
+        ]
+
+        ProcedureRun.objects.bulk_create(runs, batch_size=500)
+        return {'runs': runs}
+
+
+class ProcedureRunArchiveQuerySerializer(serializers.Serializer):
+    date_after = serializers.DateField(required=False)
+    date_before = serializers.DateField(required=False)
+    site = serializers.CharField(required=False)
+    procedure = serializers.CharField(required=False)
+    status = serializers.CharField(required=False)
@@ -1,19 +1,148 @@
-import json
+import datetime
+import logging
+import threading
 import time
 
+from django import db
+from django.conf import settings
+from django.db import (
+    models,
+    transaction,
+)
 from django.utils import timezone
 from rest_framework import exceptions
 
+from ..metrics import default_metric_registry
+
 from .builders import (
     default_procedure_builder,
     default_procedure_data_builder,
 )
+from .caches import (
+    default_procedure_result_cache,
+)
+from .codecs import (
+    decode_values,
+    encode_values,
+)
+from .engines import (
+    are_vectorizable_inputs,
+    is_vectorizable,
+    run_plan,
+    run_plan_vectorized,
+)
 from .models import ProcedureRun
+from .waiters import default_procedure_run_waiter
+
+logger = logging.getLogger(__name__)
+
+default_metric_registry.describe(
+    'procedure_run_seconds', 'histogram',
+    'time taken to load and run procedures',
+)
+default_metric_registry.describe(
+    'procedure_runs', 'gauge',
+    'number of unfinished runs by status',
+)
+
+
+def collect_procedure_run_counts():
+    counts = dict(ProcedureRun.objects.filter(
+        status__in=['pending', 'running'],
+    ).values_list('status').annotate(count=models.Count('id')))
+    return [
+        ('procedure_runs', {'status': s}, counts.get(s, 0))
+        for s in ['pending', 'running']
+    ]
+
+
+default_metric_registry.add_collector(collect_procedure_run_counts)
+
+
+def observe_procedure_run(elapsed_time):
+    # not labelled by procedure, signatures are only unique per user and
+    # timings per procedure are served to their owners by run-logs/stats
+    default_metric_registry.observe('procedure_run_seconds', elapsed_time)
+
+
+def get_run_lease():
+    """
+    duration a running run is held by its worker, the run is claimed
+    again by database workers once it expires without being finished
+    """
+    config = getattr(settings, 'ABEI_API_RUN_WORKERS', {})
+    return datetime.timedelta(seconds=config.get('LEASE', 600))
+
 
+class ProcedureRunLease(object):
+    """
+    lease of a running run held by this worker, it is extended in
+    background while the run is executed so that long runs are not
+    claimed again, results are saved only while the lease is still held
+    """
 
-def load_procedure(procedure):
+    def __init__(self, run):
+        self.run = run
+        self.lease_time = run.lease_time
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def get_queryset(self):
+        """
+        :return: queryset of run, empty once the lease is lost
+        """
+        return ProcedureRun.objects.filter(
+            id=self.run.id,
+            status='running',
+            lease_time=self.lease_time,
+        )
+
+    def extend(self):
+        lease_time = timezone.now() + get_run_lease()
+        if not self.get_queryset().update(lease_time=lease_time):
+            return False
+
+        self.lease_time = lease_time
+        return True
+
+    def keep(self, interval):
+        try:
+            while not self.stop_event.wait(interval):
+                if not self.extend():
+                    logger.warning(
+                        'lease of procedure run %s lost', self.run.uuid)
+                    return
+        except db.Error as e:
+            logger.error(
+                'failed to extend lease of procedure run %s: %s',
+                self.run.uuid, e)
+        finally:
+            db.connections.close_all()
+
+    def __enter__(self):
+        self.thread = threading.Thread(
+            target=self.keep,
+            args=(get_run_lease().total_seconds() / 3,),
+            daemon=True,
+        )
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def get_error_message(error):
+    detail = getattr(error, 'detail', None)
+    if isinstance(detail, (list, tuple)):
+        return '; '.join(str(d) for d in detail)
+    return str(detail or error)
+
+
+def load_procedure(procedure, with_plan=False):
     try:
-        procedure_object = default_procedure_builder.load_model(procedure)
+        procedure_object, plan = default_procedure_builder.load(procedure)
         if not procedure_object:
             raise exceptions.ValidationError('failed to load procedure')
 
@@ -23,22 +152,28 @@ def load_procedure(procedure):
     except Exception as e:
         raise exceptions.ValidationError('load error: {}'.format(str(e)))
 
-    return procedure_object
+    return (procedure_object, plan) if with_plan else procedure_object
 
 
-def run_procedure(procedure_object, inputs):
-    try:
-        input_signatures = procedure_object.get_input_signatures()
-        if len(inputs) != len(input_signatures):
-            raise exceptions.ValidationError('invalid inputs')
-        inputs = [
-            default_procedure_data_builder.create(sig, value=i)
-            for i, sig in zip(inputs, input_signatures)
-        ]
+def build_procedure_inputs(procedure_object, inputs):
+    input_signatures = procedure_object.get_input_signatures()
+    if len(inputs) != len(input_signatures):
+        raise exceptions.ValidationError('invalid inputs')
+    inputs = [
+        default_procedure_data_builder.create(sig, value=i)
+        for i, sig in zip(inputs, input_signatures)
+    ]
 
-        if None in inputs:
-            raise exceptions.ValidationError('invalid inputs')
+    if None in inputs:
+        raise exceptions.ValidationError('invalid inputs')
+    return inputs
 
+
+def run_procedure(procedure_object, inputs, plan=None, timings=None):
+    try:
+        inputs = build_procedure_inputs(procedure_object, inputs)
+        if plan:
+            return run_plan(plan, inputs, timings=timings)
         return procedure_object.run(inputs)
 
     except exceptions.APIException as e:
@@ -48,12 +183,119 @@ def run_procedure(procedure_object, inputs):
         raise exceptions.APIException('run error: {}'.format(str(e)))
 
 
-def load_and_run_procedure(run_uuid, inputs):
+def load_and_run_procedure_profiled(procedure, inputs):
+    """
+    load and run procedure without result cache, recording wall time of
+    loading, building inputs, running each step and reading outputs.
+    steps are only timed when procedure is compiled into plan
+
+    :return: output values, and profile
+    """
+    start = time.perf_counter()
+    procedure_object, plan = load_procedure(procedure, with_plan=True)
+    loaded = time.perf_counter()
+
+    try:
+        inputs = build_procedure_inputs(procedure_object, inputs)
+        built = time.perf_counter()
+
+        timings = []
+        outputs = (
+            run_plan(plan, inputs, timings=timings) if plan else
+            procedure_object.run(inputs)
+        )
+        finished = time.perf_counter()
+
+        outputs = [o.get_value() for o in outputs]
+
+    except exceptions.APIException as e:
+        raise e
+
+    except Exception as e:
+        raise exceptions.APIException('run error: {}'.format(str(e)))
+
+    end = time.perf_counter()
+    return outputs, {
+        'load': loaded - start,
+        'inputs': built - loaded,
+        'run': finished - built,
+        'outputs': end - finished,
+        'total': end - start,
+        'joints': [
+            {
+                'joint': step.joint,
+                'procedure': step.signature,
+                'time': elapsed,
+            } for step, elapsed in timings
+        ],
+    }
+
+
+def load_and_run_procedure_cached(procedure, inputs):
+    """
+    load and run procedure, outputs are memoized when result cache is
+    enabled, in which case repeated runs do not load procedure at all
+
+    :return: output values, and cache status: hit, miss or None
+    """
+    cache = default_procedure_result_cache
+    outputs = cache.get(procedure, inputs) if cache.enabled else None
+    if outputs is not None:
+        return outputs, 'hit'
+
+    procedure_object, plan = load_procedure(procedure, with_plan=True)
+    outputs = [
+        o.get_value() for o in
+        run_procedure(procedure_object, inputs, plan=plan)
+    ]
+    if not cache.enabled:
+        return outputs, None
+
+    # outputs of impure procedures are never memoized, nor outputs of
+    # procedures not compiled into plans, whose purity is unknown
+    if not plan or not all(s.pure for s in plan.steps):
+        return outputs, None
+
+    cache.set(procedure, inputs, outputs)
+    return outputs, 'miss'
+
+
+def run_procedure_batch(procedure_object, plan, inputs_list):
+    """
+    run procedure against many input vectors
+
+    :return: list of outputs and error message of each input vector
+    """
+    config = getattr(settings, 'ABEI_API_RUN_BATCH', {})
+    if (
+            config.get('ENGINE') == 'numpy' and
+            is_vectorizable(plan) and
+            are_vectorizable_inputs(plan, inputs_list)
+    ):
+        try:
+            return [
+                (o, None) for o in run_plan_vectorized(plan, inputs_list)
+            ]
+        except Exception:
+            pass  # fall back to run vectors one by one
+
+    results = []
+    for inputs in inputs_list:
+        try:
+            outputs = run_procedure(procedure_object, inputs, plan=plan)
+            results.append(([o.get_value() for o in outputs], None))
+        except exceptions.APIException as e:
+            results.append((None, get_error_message(e)))
+
+    return results
+
+
+def load_and_run_procedure(run_uuid, inputs=None):
     def get_procedure_run(run_uuid_):
         for _ in range(3):
             try:
                 return ProcedureRun.objects.select_related(
-                    'procedure'
+                    'procedure__site'
                 ).get(uuid=run_uuid_)
 
             except Exception as err:
@@ -64,22 +306,73 @@ def load_and_run_procedure(run_uuid, inputs):
     if not run:
         return
 
+    # claim run by compare-and-set, as database workers may claim it too
+    lease_time = timezone.now() + get_run_lease()
+    if not ProcedureRun.objects.filter(
+            id=run.id,
+            status='pending',
+    ).update(status='running', lease_time=lease_time):
+        return
+
     run.status = 'running'
-    run.save(update_fields=['status'])
+    run.lease_time = lease_time
+    finish_procedure_run(run, inputs)
 
-    try:
-        outputs = run_procedure(
-            load_procedure(run.procedure), inputs)
 
-    except Exception as e:
-        run.status = 'finished'
-        run.finished_time = timezone.now()
-        run.errors = str(e)
-        run.save(update_fields=['status', 'finished_time', 'errors'])
-        return
+def finish_procedure_run(run, inputs=None):
+    """
+    execute a run which has been claimed as running, and save its results
+    unless its lease has been lost to another worker meanwhile
+
+    :return: True if results are saved
+    """
+    if inputs is None:
+        inputs = decode_values(run.inputs) or []
 
-    outputs = [o.get_value() for o in outputs]
-    run.status = 'finished'
-    run.finished_time = timezone.now()
-    run.outputs = json.dumps(outputs)
-    run.save(update_fields=['status', 'finished_time', 'outputs'])
+    with ProcedureRunLease(run) as lease:
+        start = time.perf_counter()
+        try:
+            outputs, cache = load_and_run_procedure_cached(
+                run.procedure, inputs)
+
+        except Exception as e:
+            fields = {
+                'status': 'finished',
+                'finished_time': timezone.now(),
+                'errors': get_error_message(e),
+            }
+
+        else:
+            fields = {
+                'status': 'finished',
+                'finished_time': timezone.now(),
+                'outputs': encode_values(outputs),
+            }
+            # cache hits are left untimed, as for synchronous runs
+            if cache != 'hit':
+                fields['elapsed_time'] = time.perf_counter() - start
+                observe_procedure_run(fields['elapsed_time'])
+
+    if not lease.get_queryset().update(**fields):
+        logger.warning(
+            'lease of procedure run %s lost, results dropped', run.uuid)
+        return False
+
+    for k, v in fields.items():
+        setattr(run, k, v)
+
+    # wake requests waiting for the run in this process
+    transaction.on_commit(
+        lambda: default_procedure_run_waiter.notify(run.uuid))
+    return True
+
+
+def execute_procedure_run(run_uuid):
+    """
+    entry of runs executed by dispatcher workers, connections opened
+    by worker are released once the run is finished
+    """
+    try:
+        load_and_run_procedure(run_uuid)
+    finally:
+        db.connections.close_all()
@@ -1,16 +1,118 @@
-from unittest import skip
+import datetime
+import io
+import json
+import shutil
+import tempfile
+import time
+from unittest import (
+    mock,
+    skipUnless,
+)
 
+from django.apps import apps
+from django.core import management
+from django.db import connection
+from django.db.models import F
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+)
+from django.utils import timezone
 from mb_drf_extensions import test
 from rest_framework import (
     reverse,
     status,
 )
 
-from ..scopes import scope_of_users
+from ..metrics import MetricRegistry
+from ..scopes import (
+    scope_of_admin,
+    scope_of_users,
+)
+from . import engines
+from .archives import (
+    ProcedureRunArchive,
+    default_procedure_run_archive,
+)
+from .builders import (
+    ProcedureBuilder,
+    default_procedure_data_builder,
+)
+from .caches import ProcedureResultCache
+from .codecs import (
+    decode_values,
+    encode_values,
+)
+from .dispatchers import ProcedureRunDispatcher
+from .models import ProcedureRun
+from .tasks import (
+    finish_procedure_run,
+    load_and_run_procedure,
+    run_procedure,
+)
+from .workers import (
+    ProcedureRunWorker,
+    claim_procedure_runs,
+)
 
 uuid_of_user = 'f0889553-0eef-11eb-b3e5-a87eea00b085'
 
 
+def create_diamond_procedure(signature, depth):
+    """
+    create procedure in test-site-1 whose joints form a chain of diamonds,
+    every level reads the previous one through two different joints:
+        a[0] = x + y
+        a[k] = (a[k-1] + x) + (a[k-1] * y)
+    """
+    procedure_model = apps.get_model('editors.Procedure')
+    joint_model = apps.get_model('editors.ProcedureJoint')
+    link_model = apps.get_model('editors.ProcedureJointLink')
+
+    procedure = procedure_model.objects.create(
+        signature=signature,
+        site=apps.get_model('editors.ProcedureSite').objects.get(
+            signature='test-site-1'),
+    )
+    procedure.inputs.create(signature='float', index=0)
+    procedure.inputs.create(signature='float', index=1)
+    output = procedure.outputs.create(signature='float', index=0)
+
+    add = procedure_model.objects.get(
+        site__signature='builtin', signature='float-add')
+    mul = procedure_model.objects.get(
+        site__signature='builtin', signature='float-mul')
+
+    def create_joint(joint_signature, inner_procedure, *links):
+        joint = joint_model.objects.create(
+            signature=joint_signature,
+            outer_procedure=procedure,
+            inner_procedure=inner_procedure,
+        )
+        link_model.objects.bulk_create([
+            link_model(
+                joint=joint,
+                index=i,
+                input_joint=input_joint,
+                input_index=input_index,
+            ) for i, (input_joint, input_index) in enumerate(links)
+        ])
+        return joint
+
+    top = create_joint('a_0', add, (None, 0), (None, 1))
+    for k in range(1, depth + 1):
+        left = create_joint('l_{}'.format(k), add, (top, 0), (None, 0))
+        right = create_joint('r_{}'.format(k), mul, (top, 0), (None, 1))
+        top = create_joint('a_{}'.format(k), add, (left, 0), (right, 0))
+
+    apps.get_model('editors.ProcedureOutputLink').objects.create(
+        output=output,
+        output_joint=top,
+        output_index=0,
+    )
+    return procedure
+
+
 class ProcedureRunTest(test.APITestCase):
     fixtures = [
         'test_users.json',
@@ -55,9 +157,280 @@ class ProcedureRunTest(test.APITestCase):
         url_run_log = reverse.reverse('executors:run-logs-list')
         response = self.client.get(url_run_log)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertGreater(response.data.get('count'), 0)
+        self.assertGreater(len(response.data.get('results')), 0)
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_store_procedure_run_values(self):
+        url_run_list = reverse.reverse('executors:runs-list', [
+            'test-site-1',
+            'test-procedure-1',
+        ])
+        response = self.client.post(url_run_list, data={
+            'inputs': [3.0, 4.0],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # floats are packed as 8 bytes each after a type tag
+        run = ProcedureRun.objects.get(uuid=response.data.get('uuid'))
+        self.assertEqual(len(bytes(run.inputs)), 17)
+        self.assertEqual(len(bytes(run.outputs)), 17)
+        self.assertListEqual(decode_values(run.outputs), [19.0, 84.0])
+
+        # other values fall back to json
+        for values in [[], [1, 'a', None], [1.0, 2]]:
+            self.assertListEqual(
+                decode_values(encode_values(values)), values)
+        self.assertIsNone(encode_values(None))
+        self.assertIsNone(decode_values(b'x'))
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_list_procedure_run_logs_queries(self):
+        url_run_log = reverse.reverse('executors:run-logs-list')
+        procedure_model = apps.get_model('editors.Procedure')
+        procedures = list(procedure_model.objects.filter(
+            site__user__uuid=uuid_of_user))
+
+        # number of queries does not grow with number of runs
+        counts = []
+        for size in [1, 50]:
+            ProcedureRun.objects.bulk_create([
+                ProcedureRun(
+                    procedure=procedures[i % len(procedures)],
+                    user_id=1,
+                    status='finished',
+                    outputs=encode_values([1.0]),
+                ) for i in range(size)
+            ])
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url_run_log)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data.get('results')[0].get(
+                'outputs'), [1.0])
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_list_procedure_run_logs_by_cursor(self):
+        ProcedureRun.objects.bulk_create([
+            ProcedureRun(
+                procedure_id=1,
+                user_id=1,
+                status='finished',
+                outputs=encode_values([1.0]),
+            ) for _ in range(5)
+        ])
+        url_run_log = reverse.reverse('executors:run-logs-list')
+
+        uuids = []
+        response = self.client.get(url_run_log, data={'limit': 2})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            uuids.extend(r.get('uuid') for r in response.data['results'])
+            if not response.data.get('next'):
+                break
+            response = self.client.get(response.data.get('next'))
+
+        self.assertEqual(len(uuids), 5)
+        self.assertEqual(len(set(uuids)), 5)
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_list_procedure_run_logs_query_plan(self):
+        # runs of another user share the table
+        user = apps.get_model('users.User').objects.create(
+            uuid='00000000-0000-0000-0000-000000000002')
+        start = timezone.now() - datetime.timedelta(days=30)
+        ProcedureRun.objects.bulk_create([
+            ProcedureRun(
+                procedure_id=1,
+                user_id=1 if i % 2 else user.id,
+                status='finished' if i % 3 else 'pending',
+                finished_time=start + datetime.timedelta(hours=i),
+                outputs=encode_values([1.0]),
+            ) for i in range(600)
+        ])
+        # created_time is set on insert, spread runs over the month
+        ProcedureRun.objects.update(created_time=F('finished_time'))
+        url_run_log = reverse.reverse('executors:run-logs-list')
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url_run_log, data={
+                'status': 'finished',
+                'created_time_after': (
+                    start + datetime.timedelta(days=7)).isoformat(),
+            })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data.get('results')), 100)
+
+        # page is read in index order instead of sorting scoped rows
+        if connection.vendor == 'sqlite':
+            sql = next(
+                q['sql'] for q in context.captured_queries
+                if 'executors_procedurerun' in q['sql'] and
+                'ORDER BY' in q['sql']
+            )
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = ' '.join(str(r) for r in cursor.fetchall())
+            self.assertIn('run_', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_export_procedure_run_logs(self):
+        ProcedureRun.objects.bulk_create([
+            ProcedureRun(
+                procedure_id=1,
+                user_id=1,
+                status='finished',
+                outputs=encode_values([1.0]),
+            ) for _ in range(3)
+        ])
+        url_run_export = reverse.reverse('executors:run-logs-export')
+
+        response = self.client.get(url_run_export)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        records = [
+            json.loads(line) for line in
+            b''.join(response.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0].get('site'), 'test-site-1')
+        self.assertEqual(records[0].get('procedure'), 'test-procedure-1')
+        self.assertListEqual(records[0].get('outputs'), [1.0])
+
+        response = self.client.get(url_run_export, data={'output': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b''.join(
+            response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('uuid,site,procedure'))
+
+        response = self.client.get(url_run_export, data={'output': 'xml'})
+        self.assertEqual(
+            response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_prune_procedure_runs(self):
+        ProcedureRun.objects.bulk_create([
+            ProcedureRun(
+                procedure_id=1,
+                user_id=1,
+                status=s,
+                inputs=encode_values([3.0, 4.0]),
+                outputs=encode_values([19.0, 84.0]),
+            ) for s in ['finished', 'finished', 'pending', 'finished']
+        ])
+        run_ids = list(ProcedureRun.objects.order_by(
+            'id').values_list('id', flat=True))
+        ProcedureRun.objects.filter(id__in=run_ids[:3]).update(
+            created_time=timezone.now() - datetime.timedelta(days=31))
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with mock.patch.object(
+                default_procedure_run_archive, 'directory', directory):
+            management.call_command(
+                'prune_runs', days=30, batch_size=1, stdout=io.StringIO())
+
+            # pending and recent runs are kept
+            self.assertListEqual(list(ProcedureRun.objects.order_by(
+                'id').values_list('id', flat=True)), run_ids[2:])
+
+            url_run_archive = reverse.reverse('executors:run-archives-list')
+            response = self.client.get(url_run_archive)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            records = [
+                json.loads(line) for line in
+                b''.join(response.streaming_content).decode().splitlines()
+            ]
+            self.assertEqual(len(records), 2)
+            self.assertEqual(records[0].get('procedure'), 'test-procedure-1')
+            self.assertListEqual(records[0].get('inputs'), [3.0, 4.0])
+            self.assertListEqual(records[0].get('outputs'), [19.0, 84.0])
+
+            response = self.client.get(url_run_archive, data={
+                'date_after': timezone.now().date().isoformat(),
+            })
+            self.assertEqual(b''.join(response.streaming_content), b'')
+
+    def test_archive_procedure_runs_again(self):
+        ProcedureRun.objects.bulk_create([
+            ProcedureRun(procedure_id=1, user_id=1, status='finished')
+            for _ in range(3)
+        ])
+        run_ids = list(ProcedureRun.objects.order_by(
+            'id').values_list('id', flat=True))
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        archive = ProcedureRunArchive(directory)
+
+        # batches archived again after their deletion failed, with the
+        # same bounds or not, are read once
+        for batch_ids in [run_ids[:2], run_ids[:2], run_ids[1:]]:
+            self.assertEqual(archive.write(
+                ProcedureRun.objects.filter(id__in=batch_ids),
+                batch_ids[0],
+            ), len(batch_ids))
+
+        records = list(archive.read(uuid_of_user))
+        self.assertListEqual(
+            sorted(r.get('uuid') for r in records),
+            sorted(str(u) for u in ProcedureRun.objects.values_list(
+                'uuid', flat=True)),
+        )
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_create_procedure_run_after_edit(self):
+        url_run_list = reverse.reverse('executors:runs-list', [
+            'test-site-1',
+            'test-procedure-1',
+        ])
+        response = self.client.post(url_run_list, data={
+            'inputs': [3.0, 4.0],
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertListEqual(response.data.get('outputs'), [19.0, 84.0])
+
+        # edits should be visible on the very next run
+        url_output_link = reverse.reverse('editors:procedure-outputs-link', [
+            'test-site-1',
+            'test-procedure-1',
+            0,
+        ])
+        response = self.client.put(url_output_link, data={
+            'output_joint': 'mul_1',
+            'output_index': 0,
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post(url_run_list, data={
+            'inputs': [3.0, 4.0],
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertListEqual(response.data.get('outputs'), [12.0, 84.0])
 
-    @skip('async run is not ready')
     @test.authentication_mock(
         user_uuid=uuid_of_user,
         user_scopes=[scope_of_users]
@@ -69,6 +442,660 @@ class ProcedureRunTest(test.APITestCase):
         ])
         response = self.client.post(url_run_async, data={
             'inputs': [3.0, 4.0],
-        })
+        }, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data.get('status'), 'pending')
         self.assertIsNone(response.data.get('outputs'))
+        run_uuid = response.data.get('uuid')
+
+        # queued runs are observable
+        url_run_queue = reverse.reverse('executors:run-logs-queue')
+        response = self.client.get(url_run_queue)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.get('pending'), 1)
+
+        # execute it as a dispatcher worker would do
+        ProcedureRunDispatcher(mode='inline').dispatch(run_uuid)
+
+        url_run_detail = reverse.reverse('executors:runs-detail', [
+            'test-site-1',
+            'test-procedure-1',
+            run_uuid,
+        ])
+        response = self.client.get(url_run_detail)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.get('status'), 'finished')
+        self.assertListEqual(response.data.get('outputs'), [19.0, 84.0])
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_wait_procedure_run(self):
+        run = ProcedureRun.objects.create(
+            procedure_id=1,
+            user_id=1,
+            inputs=encode_values([3.0, 4.0]),
+        )
+        url_run_detail = reverse.reverse('executors:runs-detail', [
+            'test-site-1',
+            'test-procedure-1',
+            run.uuid,
+        ])
+
+        # long poll expires while run is pending
+        start = time.monotonic()
+        response = self.client.get(url_run_detail, data={'wait': 0.2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.get('status'), 'pending')
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+        response = self.client.get(url_run_detail, data={'wait': 'x'})
+        self.assertEqual(
+            response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        ProcedureRunDispatcher(mode='inline').dispatch(run.uuid)
+        start = time.monotonic()
+        response = self.client.get(url_run_detail, data={'wait': 10})
+        self.assertEqual(response.data.get('status'), 'finished')
+        self.assertLess(time.monotonic() - start, 1)
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_stream_procedure_run_events(self):
+        finished, pending = [
+            ProcedureRun.objects.create(
+                procedure_id=1,
+                user_id=1,
+                status=s,
+                outputs=encode_values([1.0]),
+            ) for s in ['finished', 'pending']
+        ]
+        url_run_events = reverse.reverse('executors:run-logs-events')
+
+        response = self.client.get(url_run_events, data={
+            'uuids': '{},{}'.format(finished.uuid, pending.uuid),
+            'wait': 0.1,
+        }, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = [
+            dict(line.split(': ', 1) for line in e.splitlines())
+            for e in b''.join(
+                response.streaming_content).decode().split('\n\n') if e
+        ]
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[0].get('event'), 'finished')
+        self.assertEqual(events[0].get('id'), str(finished.uuid))
+        self.assertListEqual(
+            json.loads(events[0].get('data')).get('outputs'), [1.0])
+        self.assertEqual(events[1].get('event'), 'timeout')
+        self.assertListEqual(
+            json.loads(events[1].get('data')), [str(pending.uuid)])
+
+        response = self.client.get(url_run_events, data={'uuids': 'x'})
+        self.assertEqual(
+            response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_create_procedure_run_profiled(self):
+        url_run_list = reverse.reverse('executors:runs-list', [
+            'test-site-1',
+            'test-procedure-1',
+        ])
+        response = self.client.post(url_run_list + '?profile=1', data={
+            'inputs': [3.0, 4.0],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertListEqual(response.data.get('outputs'), [19.0, 84.0])
+        profile = response.data.get('profile')
+        for phase in ['load', 'inputs', 'run', 'outputs', 'total']:
+            self.assertGreaterEqual(profile.get(phase), 0)
+        self.assertListEqual(
+            [j.get('joint') for j in profile.get('joints')],
+            [s.joint for s in ProcedureBuilder().load_plan(
+                apps.get_model('editors.Procedure').objects.get(id=1)
+            ).steps],
+        )
+
+        # breakdown is kept with the run
+        run = ProcedureRun.objects.get(uuid=response.data.get('uuid'))
+        self.assertDictEqual(json.loads(run.profile), profile)
+
+        response = self.client.post(url_run_list, data={
+            'inputs': [3.0, 4.0],
+        }, format='json')
+        self.assertIsNone(response.data.get('profile'))
+
+        url_run_stats = reverse.reverse('executors:run-logs-stats')
+        response = self.client.get(url_run_stats)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0].get('site'), 'test-site-1')
+        self.assertEqual(
+            response.data[0].get('procedure'), 'test-procedure-1')
+        self.assertEqual(response.data[0].get('count'), 2)
+        self.assertLessEqual(
+            response.data[0].get('minimum'), response.data[0].get('maximum'))
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users, scope_of_admin]
+    )
+    def test_export_metrics(self):
+        url_run_list = reverse.reverse('executors:runs-list', [
+            'test-site-1',
+            'test-procedure-1',
+        ])
+        response = self.client.post(url_run_list, data={
+            'inputs': [3.0, 4.0],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ProcedureRun.objects.create(procedure_id=1, user_id=1)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        metrics = response.content.decode()
+        for line in [
+            '# TYPE http_request_duration_seconds histogram',
+            'http_request_duration_seconds_count{action="create",'
+            'method="POST",status="201",view="runs-list"}',
+            'http_request_queries_count{action="create",view="runs-list"}',
+            'procedure_cache_total{result="miss"}',
+            'procedure_load_seconds_count',
+            'procedure_run_seconds_count ',
+            'procedure_runs{status="pending"} 1',
+        ]:
+            self.assertIn(line, metrics)
+        self.assertNotIn('test-procedure-1', metrics)
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_export_metrics_without_admin_scope(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_limit_metric_series(self):
+        registry = MetricRegistry(max_series=2)
+        for i in range(4):
+            registry.observe('seconds', 0.1, procedure=i)
+        registry.inc('requests')
+
+        samples = registry.collect()
+        self.assertEqual(len(samples), 3)
+        self.assertEqual(samples[MetricRegistry.dropped_key], 3)
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_create_procedure_run_batch(self):
+        url_run_batch = reverse.reverse('executors:runs-batch', [
+            'test-site-1',
+            'test-procedure-1',
+        ])
+        response = self.client.post(url_run_batch, data={
+            'inputs': [[3.0, 4.0], [1.0, 2.0], [1.0]],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        runs = response.data.get('runs')
+        self.assertEqual(len(runs), 3)
+        self.assertListEqual(runs[0].get('outputs'), [19.0, 84.0])
+        self.assertListEqual(runs[1].get('outputs'), [5.0, 6.0])
+        self.assertIsNone(runs[2].get('outputs'))
+        self.assertIsNotNone(runs[2].get('errors'))
+        self.assertEqual(ProcedureRun.objects.count(), 3)
+
+    @skipUnless(engines.numpy, 'numpy is not installed')
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_create_procedure_run_batch_engines(self):
+        url_run_batch = reverse.reverse('executors:runs-batch', [
+            'test-site-1',
+            'test-procedure-1',
+        ])
+
+        # results do not depend on engine, whatever the values are
+        for inputs in [
+            [[3.0, 4.0], [1.0, 2.0]],
+            [[3, 4], [2 ** 60 + 1, 2]],
+            [[3, 4.0], [True, 2.0], ['1.5', 2.0]],
+        ]:
+            results = []
+            for engine in ['scalar', 'numpy']:
+                with override_settings(ABEI_API_RUN_BATCH={
+                    'MAX_SIZE': 10000,
+                    'ENGINE': engine,
+                }):
+                    response = self.client.post(url_run_batch, data={
+                        'inputs': inputs,
+                    }, format='json')
+                self.assertEqual(
+                    response.status_code, status.HTTP_201_CREATED)
+                results.append([
+                    (r.get('outputs'), r.get('errors') is None)
+                    for r in response.data.get('runs')
+                ])
+            self.assertListEqual(results[0], results[1])
+
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_create_procedure_run_cached(self):
+        url_run_list = reverse.reverse('executors:runs-list', [
+            'test-site-1',
+            'test-procedure-1',
+        ])
+        result_cache = ProcedureResultCache(max_size=16)
+        with mock.patch(
+                'apps.executors.tasks.default_procedure_result_cache',
+                result_cache,
+        ):
+            for cache in ['miss', 'hit']:
+                response = self.client.post(url_run_list, data={
+                    'inputs': [3.0, 4.0],
+                }, format='json')
+                self.assertEqual(
+                    response.status_code, status.HTTP_201_CREATED)
+                self.assertEqual(response.data.get('cache'), cache)
+                self.assertListEqual(
+                    response.data.get('outputs'), [19.0, 84.0])
+
+            # cache hits are left out of run statistics
+            self.assertListEqual(list(ProcedureRun.objects.order_by(
+                'id').values_list('elapsed_time__isnull', flat=True)
+            ), [False, True])
+            response = self.client.get(
+                reverse.reverse('executors:run-logs-stats'))
+            self.assertEqual(response.data[0].get('count'), 1)
+
+            # cached results are dropped once procedure is edited
+            output_link = apps.get_model(
+                'editors.ProcedureOutputLink').objects.get(output_id=1)
+            output_link.output_joint_id = 2
+            output_link.save()
+
+            response = self.client.post(url_run_list, data={
+                'inputs': [3.0, 4.0],
+            }, format='json')
+            self.assertEqual(response.data.get('cache'), 'miss')
+            self.assertListEqual(response.data.get('outputs'), [12.0, 84.0])
+
+    @override_settings(ABEI_API_IMPURE_PROCEDURES=['float-add'])
+    @test.authentication_mock(
+        user_uuid=uuid_of_user,
+        user_scopes=[scope_of_users]
+    )
+    def test_create_procedure_run_uncompiled_not_cached(self):
+        url_run_list = reverse.reverse('executors:runs-list', [
+            'test-site-1',
+            'test-procedure-1',
+        ])
+        result_cache = ProcedureResultCache(max_size=16)
+
+        # purity of procedures without plan is unknown, they may run
+        # impure builtins
+        with mock.patch(
+                'apps.executors.tasks.default_procedure_result_cache',
+                result_cache,
+        ), mock.patch(
+                'apps.executors.builders.compile_plan',
+                side_effect=engines.PlanError('not compiled'),
+        ), mock.patch(
+                'apps.executors.tasks.default_procedure_builder',
+                ProcedureBuilder(),
+        ):
+            for _ in range(2):
+                response = self.client.post(url_run_list, data={
+                    'inputs': [3.0, 4.0],
+                }, format='json')
+                self.assertEqual(
+                    response.status_code, status.HTTP_201_CREATED)
+                self.assertIsNone(response.data.get('cache'))
+                self.assertListEqual(
+                    response.data.get('outputs'), [19.0, 84.0])
+
+
+class ProcedureRunWorkerTest(test.APITestCase):
+    fixtures = [
+        'test_users.json',
+        'test_executors.json',
+    ]
+
+    def test_claim_procedure_runs(self):
+        run = ProcedureRun.objects.create(
+            procedure_id=1,
+            inputs=encode_values([3.0, 4.0]),
+        )
+        self.assertListEqual(claim_procedure_runs(10), [run.id])
+        self.assertListEqual(claim_procedure_runs(10), [])
+
+        # runs of crashed workers are claimed again once lease expired
+        ProcedureRun.objects.filter(id=run.id).update(
+            lease_time=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertListEqual(claim_procedure_runs(10), [run.id])
+
+    def test_run_worker(self):
+        run = ProcedureRun.objects.create(
+            procedure_id=1,
+            inputs=encode_values([3.0, 4.0]),
+        )
+        self.assertEqual(ProcedureRunWorker().run_once(), 1)
+        self.assertEqual(ProcedureRunWorker().run_once(), 0)
+
+        run.refresh_from_db()
+        self.assertEqual(run.status, 'finished')
+        self.assertListEqual(decode_values(run.outputs), [19.0, 84.0])
+
+    def test_finish_procedure_run_after_lease_lost(self):
+        run = ProcedureRun.objects.create(
+            procedure_id=1,
+            inputs=encode_values([3.0, 4.0]),
+        )
+        self.assertListEqual(claim_procedure_runs(1), [run.id])
+        run.refresh_from_db()
+
+        # lease expired and run is claimed again by another worker
+        ProcedureRun.objects.filter(id=run.id).update(
+            lease_time=run.lease_time + datetime.timedelta(seconds=1))
+        self.assertFalse(finish_procedure_run(run))
+
+        run.refresh_from_db()
+        self.assertEqual(run.status, 'running')
+        self.assertIsNone(run.outputs)
+
+    def test_dispatch_claimed_procedure_run(self):
+        run = ProcedureRun.objects.create(
+            procedure_id=1,
+            inputs=encode_values([3.0, 4.0]),
+        )
+        self.assertListEqual(claim_procedure_runs(1), [run.id])
+
+        # run claimed by a database worker is not executed again
+        load_and_run_procedure(run.uuid)
+        run.refresh_from_db()
+        self.assertEqual(run.status, 'running')
+        self.assertIsNone(run.outputs)
+
+
+class ProcedureBuilderTest(test.APITestCase):
+    fixtures = [
+        'test_users.json',
+        'test_executors.json',
+    ]
+
+    def test_load_diamond_procedure(self):
+        procedure = create_diamond_procedure('diamond-3', depth=3)
+        procedure_object = ProcedureBuilder().load_model(procedure)
+        outputs = run_procedure(procedure_object, [1.0, 1.0])
+        self.assertListEqual([o.get_value() for o in outputs], [23.0])
+
+    def test_load_deep_diamond_procedure(self):
+        # without sharing joints, this would expand into 2 ** depth joints
+        depth = 40
+        procedure = create_diamond_procedure('diamond-deep', depth=depth)
+        builder = ProcedureBuilder()
+        builder.joint_factory = mock.Mock(wraps=builder.joint_factory)
+
+        builder.load_model(procedure)
+
+        self.assertEqual(
+            builder.joint_factory.create.call_count, 3 * depth + 1)
+
+    def test_load_procedure_queries(self):
+        # queries are issued per level of nesting, not per joint or link
+        query_counts = []
+        for depth in [1, 10]:
+            procedure = create_diamond_procedure(
+                'diamond-{}'.format(depth), depth=depth)
+            with CaptureQueriesContext(connection) as context:
+                ProcedureBuilder().load_model(procedure)
+            query_counts.append(len(context.captured_queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertLessEqual(query_counts[1], 8)
+
+    def test_load_procedure_from_cache(self):
+        procedure = create_diamond_procedure('diamond-3', depth=3)
+        builder = ProcedureBuilder()
+        procedure_object = builder.load_model(procedure)
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertIs(builder.load_model(procedure), procedure_object)
+        self.assertEqual(len(context.captured_queries), 0)
+
+        # editing the procedure bumps its revision and evicts it
+        procedure.joints.get(signature='a_0').save()
+        procedure.refresh_from_db()
+        self.assertIsNot(builder.load_model(procedure), procedure_object)
+
+    def test_compile_plan(self):
+        procedure = create_diamond_procedure('diamond-3', depth=3)
+        plan = ProcedureBuilder().load_plan(procedure)
+        self.assertEqual(len(plan.steps), 10)
+        self.assertListEqual(plan.output_slots, [plan.slot_count - 1])
+
+        # every step only reads slots written before it
+        for step in plan.steps:
+            self.assertLess(max(step.input_slots), min(step.output_slots))
+
+    def test_compile_nested_plan(self):
+        site_model = apps.get_model('editors.ProcedureSite')
+        procedure_model = apps.get_model('editors.Procedure')
+        site = site_model.objects.create(
+            signature='test-site-nested',
+            user_id=1,
+        )
+        site.base_sites.add(site_model.objects.get(signature='test-site-1'))
+
+        # out = sum of both outputs of test-procedure-1
+        procedure = procedure_model.objects.create(
+            signature='nested',
+            site=site,
+        )
+        procedure.inputs.create(signature='float', index=0)
+        procedure.inputs.create(signature='float', index=1)
+        output = procedure.outputs.create(signature='float', index=0)
+        inner = procedure.joints.create(
+            signature='inner',
+            inner_procedure=procedure_model.objects.get(id=1),
+        )
+        inner.links.create(index=0, input_index=0)
+        inner.links.create(index=1, input_index=1)
+        add = procedure.joints.create(
+            signature='add',
+            inner_procedure=procedure_model.objects.get(
+                signature='float-add'),
+        )
+        add.links.create(index=0, input_joint=inner, input_index=0)
+        add.links.create(index=1, input_joint=inner, input_index=1)
+        apps.get_model('editors.ProcedureOutputLink').objects.create(
+            output=output,
+            output_joint=add,
+            output_index=0,
+        )
+
+        # steps of inner procedure are inlined
+        builder = ProcedureBuilder()
+        procedure_object, plan = builder.load(procedure)
+        self.assertEqual(len(plan.steps), 5)
+
+        inputs = [
+            default_procedure_data_builder.create('float', value=v)
+            for v in [3.0, 4.0]
+        ]
+        self.assertListEqual(
+            [o.get_value() for o in engines.run_plan(plan, inputs)],
+            [103.0],
+        )
+        self.assertListEqual(
+            [o.get_value() for o in procedure_object.run(inputs)],
+            [103.0],
+        )
+
+    @override_settings(ABEI_API_PLAN_INLINE_STEPS=8)
+    def test_compile_reused_nested_plan(self):
+        # p[0](x, y) = x + y
+        # p[k](x, y) = p[k-1](p[k-1](p[k-1](x, y), y), x)
+        # every level calls the previous one 3 times with different
+        # inputs, inlining all of them would take 3 ** depth steps
+        depth = 6
+        procedure_model = apps.get_model('editors.Procedure')
+        site = apps.get_model('editors.ProcedureSite').objects.get(
+            signature='test-site-1')
+        inner = procedure_model.objects.get(
+            site__signature='builtin', signature='float-add')
+        for k in range(depth + 1):
+            procedure = procedure_model.objects.create(
+                signature='reused-{}'.format(k),
+                site=site,
+            )
+            procedure.inputs.create(signature='float', index=0)
+            procedure.inputs.create(signature='float', index=1)
+            output = procedure.outputs.create(signature='float', index=0)
+
+            # each call reads the previous one, or x, and then y or x
+            joint = None
+            for i, second in enumerate([1] if k == 0 else [1, 1, 0]):
+                previous = joint
+                joint = procedure.joints.create(
+                    signature='call_{}'.format(i),
+                    inner_procedure=inner,
+                )
+                joint.links.create(
+                    index=0, input_joint=previous, input_index=0)
+                joint.links.create(index=1, input_index=second)
+            apps.get_model('editors.ProcedureOutputLink').objects.create(
+                output=output,
+                output_joint=joint,
+                output_index=0,
+            )
+            inner = procedure
+
+        def expected(k, x, y):
+            if k == 0:
+                return x + y
+            return expected(k - 1, expected(
+                k - 1, expected(k - 1, x, y), y), x)
+
+        plan = ProcedureBuilder().load_plan(procedure)
+        self.assertLessEqual(len(plan.steps), 3 * 8)
+
+        inputs = [
+            default_procedure_data_builder.create('float', value=v)
+            for v in [3.0, 4.0]
+        ]
+        self.assertListEqual(
+            [o.get_value() for o in engines.run_plan(plan, inputs)],
+            [expected(depth, 3.0, 4.0)],
+        )
+
+    def test_merge_pure_joints(self):
+        procedure_model = apps.get_model('editors.Procedure')
+        procedure = procedure_model.objects.create(
+            signature='square-sum',
+            site=apps.get_model('editors.ProcedureSite').objects.get(
+                signature='test-site-1'),
+        )
+        procedure.inputs.create(signature='float', index=0)
+        procedure.inputs.create(signature='float', index=1)
+        output = procedure.outputs.create(signature='float', index=0)
+
+        # out = x * y + x * y, both products are the same joint
+        add = procedure.joints.create(
+            signature='add',
+            inner_procedure=procedure_model.objects.get(
+                signature='float-add'),
+        )
+        for k in range(2):
+            mul = procedure.joints.create(
+                signature='mul_{}'.format(k),
+                inner_procedure=procedure_model.objects.get(
+                    signature='float-mul'),
+            )
+            mul.links.create(index=0, input_index=0)
+            mul.links.create(index=1, input_index=1)
+            add.links.create(index=k, input_joint=mul, input_index=0)
+        apps.get_model('editors.ProcedureOutputLink').objects.create(
+            output=output,
+            output_joint=add,
+            output_index=0,
+        )
+
+        builder = ProcedureBuilder()
+        builder.joint_factory = mock.Mock(wraps=builder.joint_factory)
+        procedure_object, plan = builder.load(procedure)
+        self.assertEqual(builder.joint_factory.create.call_count, 2)
+        self.assertEqual(len(plan.steps), 2)
+
+        inputs = [
+            default_procedure_data_builder.create('float', value=v)
+            for v in [3.0, 4.0]
+        ]
+        self.assertListEqual(
+            [o.get_value() for o in engines.run_plan(plan, inputs)],
+            [24.0],
+        )
+        self.assertListEqual(
+            [o.get_value() for o in procedure_object.run(inputs)],
+            [24.0],
+        )
+
+    def test_benchmark_procedures(self):
+        stdout = io.StringIO()
+        management.call_command(
+            'benchmark_procedures',
+            depth=3,
+            width=2,
+            fan_in=3,
+            repeat=5,
+            batch_size=10,
+            run_logs=300,
+            run_log_users=3,
+            run_log_pages=3,
+            stdout=stdout,
+        )
+        results = json.loads(stdout.getvalue())
+        self.assertEqual(results['procedure']['joints'], 6)
+        self.assertEqual(results['run_logs']['pages']['count'], 3)
+        self.assertGreater(results['run_logs']['queries_per_page'], 0)
+        self.assertEqual(results['run']['count'], 5)
+        self.assertEqual(results['batch']['errors'], 0)
+        self.assertEqual(results['load']['warm_queries'], 0)
+        self.assertGreater(results['load']['cold_queries'], 0)
+
+        # generated data is rolled back
+        self.assertFalse(apps.get_model('editors.Procedure').objects.filter(
+            signature__startswith='benchmark-').exists())
+        self.assertFalse(ProcedureRun.objects.exists())
+
+    @skipUnless(engines.numpy, 'numpy is not installed')
+    def test_run_plan_vectorized(self):
+        procedure = create_diamond_procedure('diamond-3', depth=3)
+        procedure_object, plan = ProcedureBuilder().load(procedure)
+        self.assertTrue(engines.is_vectorizable(plan))
+
+        inputs_list = [[1.0, 1.0], [3.0, 4.0], [-2.0, 0.5]]
+        self.assertListEqual(
+            engines.run_plan_vectorized(plan, inputs_list),
+            [
+                [o.get_value() for o in run_procedure(procedure_object, i)]
+                for i in inputs_list
+            ],
+        )
+
+        # values numpy would convert silently are run one by one
+        self.assertTrue(engines.are_vectorizable_inputs(plan, [[1.0, 2.0]]))
+        for inputs in [[1, 2.0], [True, 1.0], ['1.5', 1.0], [None, 1.0]]:
+            self.assertFalse(engines.are_vectorizable_inputs(plan, [inputs]))
@@ -11,6 +11,7 @@ from .views import (
     ProcedureViewSet,
     ProcedureRunViewSet,
     ProcedureRunLogViewSet,
+    ProcedureRunArchiveViewSet,
 )
 
 app_name = 'executors'
@@ -38,6 +39,11 @@ router.register(
     ProcedureRunLogViewSet,
     basename='run-logs',
 )
+router.register(
+    'run-archives',
+    ProcedureRunArchiveViewSet,
+    basename='run-archives',
+)
 
 urlpatterns = [
     path('', include(router.urls)),
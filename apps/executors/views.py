@@ -1,16 +1,34 @@
+import csv
+import datetime
+import json
+import uuid
+
 from django.apps import apps
+from django.db import models
+from django.http import StreamingHttpResponse
 from rest_framework import (
     exceptions,
     decorators,
     mixins,
     response,
+    settings,
     status,
     viewsets,
 )
 
+from ..editors.models import readable_sites
 from ..mixins import NestedViewSetMixin
 from ..permissions import UserPermission
 
+from .archives import (
+    default_procedure_run_archive,
+)
+from .codecs import (
+    decode_values,
+)
+from .dispatchers import (
+    default_procedure_run_dispatcher,
+)
 from .filters import (
     ProcedureRunFilterSet,
     ProcedureRunLogFilterSet,
@@ -18,14 +36,38 @@ from .filters import (
 from .models import (
     ProcedureRun,
 )
+from .paginations import (
+    ProcedureRunCursorPagination,
+)
+from .renderers import (
+    EventStreamRenderer,
+)
 from .serializers import (
     ProcedureRunSerializer,
     ProcedureRunLogSerializer,
     ProcedureRunCreateSyncSerializer,
     ProcedureRunCreateASyncSerializer,
+    ProcedureRunCreateBatchSerializer,
+    ProcedureRunArchiveQuerySerializer,
+)
+from .waiters import (
+    default_procedure_run_waiter,
 )
 
 
+def get_wait_timeout(request, default=0.0):
+    """
+    seconds a request may wait for runs to finish, given by ?wait=
+    """
+    try:
+        timeout = float(request.query_params.get('wait', default))
+    except ValueError:
+        raise exceptions.ValidationError('invalid wait')
+    if not 0 <= timeout < float('inf'):
+        raise exceptions.ValidationError('invalid wait')
+    return timeout
+
+
 class ProcedureSiteViewSet(viewsets.GenericViewSet):
     """
     viewset that do nothing
@@ -47,17 +89,26 @@ class ProcedureRunViewSet(
 ):
     filter_class = ProcedureRunFilterSet
     lookup_field = 'uuid'
+    pagination_class = ProcedureRunCursorPagination
     permission_classes = [UserPermission]
     queryset = ProcedureRun.objects.all()
     serializer_class = ProcedureRunSerializer
     serializer_class_mapping = {
         'create': ProcedureRunCreateSyncSerializer,
         'create_async': ProcedureRunCreateASyncSerializer,
+        'create_batch': ProcedureRunCreateBatchSerializer,
     }
 
     def get_queryset(self):
         return super().get_queryset().filter(
-            procedure__site__user__uuid=self.request.user.uuid)
+            user__uuid=self.request.user.uuid,
+        ).only(
+            'uuid',
+            'status',
+            'created_time',
+            'finished_time',
+            'outputs',
+        )
 
     def get_serializer_class(self):
         return (
@@ -67,15 +118,35 @@ class ProcedureRunViewSet(
 
     def get_procedure(self):
         procedure = apps.get_model('editors.Procedure').objects.filter(
-            site__user__uuid=self.request.user.uuid,
+            readable_sites(self.request.user.uuid, 'site__'),
             **self.get_parents_query_dict_ex(ignore_prefix='procedure__')
-        ).first()
+        ).select_related('site').first()
         if not procedure:
             raise exceptions.NotFound('invalid procedure')
         return procedure
 
+    def save_run(self, serializer):
+        procedure = self.get_procedure()
+
+        # runs of procedures in shared sites belong to requesting user
+        if procedure.site.user_id is None:
+            return serializer.save(
+                procedure=procedure,
+                user_id=self.request.user.user_persist().id,
+            )
+        return serializer.save(procedure=procedure)
+
+    def retrieve(self, request, *args, **kwargs):
+        # long poll, respond once run finished or wait expired
+        timeout = get_wait_timeout(request)
+        if timeout:
+            default_procedure_run_waiter.wait(
+                self.get_object().uuid, timeout)
+
+        return super().retrieve(request, *args, **kwargs)
+
     def perform_create(self, serializer):
-        return serializer.save(procedure=self.get_procedure())
+        return self.save_run(serializer)
 
     @decorators.action(
         methods=['post'],
@@ -86,11 +157,35 @@ class ProcedureRunViewSet(
     def create_async(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save(procedure=self.get_procedure())
+        self.save_run(serializer)
 
         return response.Response(
             serializer.data, status=status.HTTP_201_CREATED)
 
+    @decorators.action(
+        methods=['post'],
+        url_name='batch',
+        url_path='batch',
+        detail=False,
+    )
+    def create_batch(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.save_run(serializer)
+
+        return response.Response(
+            serializer.data, status=status.HTTP_201_CREATED)
+
+
+class EchoBuffer(object):
+    """
+    file-like object handing written csv rows back to the caller
+    """
+
+    @staticmethod
+    def write(value):
+        return value
+
 
 class ProcedureRunLogViewSet(
     mixins.ListModelMixin,
@@ -99,10 +194,226 @@ class ProcedureRunLogViewSet(
 ):
     filter_class = ProcedureRunLogFilterSet
     lookup_field = 'uuid'
+    pagination_class = ProcedureRunCursorPagination
     permission_classes = [UserPermission]
     queryset = ProcedureRun.objects.all()
     serializer_class = ProcedureRunLogSerializer
 
     def get_queryset(self):
+        # runs are scoped by their own user column so that a page is a
+        # range of run_user_created_idx, signatures are read from joined
+        # rows instead of one query per run
         return super().get_queryset().filter(
-            procedure__site__user__uuid=self.request.user.uuid)
+            user__uuid=self.request.user.uuid,
+        ).select_related(
+            'procedure__site',
+        ).only(
+            'uuid',
+            'status',
+            'created_time',
+            'finished_time',
+            'outputs',
+            'procedure__signature',
+            'procedure__site__signature',
+        )
+
+    @decorators.action(
+        methods=['get'],
+        url_name='queue',
+        url_path='queue',
+        detail=False,
+    )
+    def queue(self, request, *args, **kwargs):
+        counts = dict(self.get_queryset().filter(
+            status__in=['pending', 'running'],
+        ).values_list('status').annotate(count=models.Count('id')))
+
+        return response.Response({
+            'pending': counts.get('pending', 0),
+            'running': counts.get('running', 0),
+            'dispatching': default_procedure_run_dispatcher.queue_depth,
+        })
+
+    @decorators.action(
+        methods=['get'],
+        url_name='stats',
+        url_path='stats',
+        detail=False,
+    )
+    def stats(self, request, *args, **kwargs):
+        # timing of filtered runs aggregated per procedure
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            elapsed_time__isnull=False,
+        ).values(
+            'procedure__site__signature',
+            'procedure__signature',
+        ).annotate(
+            count=models.Count('id'),
+            average=models.Avg('elapsed_time'),
+            minimum=models.Min('elapsed_time'),
+            maximum=models.Max('elapsed_time'),
+        ).order_by(
+            'procedure__site__signature',
+            'procedure__signature',
+        )
+
+        return response.Response([
+            {
+                'site': s.pop('procedure__site__signature'),
+                'procedure': s.pop('procedure__signature'),
+                **s,
+            } for s in queryset
+        ])
+
+    event_max_runs = 1000
+
+    def iterate_events(self, run_uuids, timeout):
+        finished = set()
+        for run_uuid in default_procedure_run_waiter.iterate_finished(
+                run_uuids, timeout):
+            finished.add(run_uuid)
+            serializer = self.get_serializer(
+                self.get_queryset().get(uuid=run_uuid))
+            yield 'id: {}\nevent: finished\ndata: {}\n\n'.format(
+                run_uuid, json.dumps(serializer.data))
+
+        yield 'event: timeout\ndata: {}\n\n'.format(
+            json.dumps(sorted(set(run_uuids) - finished)))
+
+    @decorators.action(
+        methods=['get'],
+        url_name='events',
+        url_path='events',
+        detail=False,
+        renderer_classes=[
+            *settings.api_settings.DEFAULT_RENDERER_CLASSES,
+            EventStreamRenderer,
+        ],
+    )
+    def events(self, request, *args, **kwargs):
+        try:
+            run_uuids = [
+                uuid.UUID(u) for u in
+                request.query_params.get('uuids', '').split(',') if u
+            ]
+        except ValueError:
+            raise exceptions.ValidationError('invalid uuids')
+        if not 0 < len(run_uuids) <= self.event_max_runs:
+            raise exceptions.ValidationError('invalid uuids')
+
+        # runs of other users are never reported
+        run_uuids = [str(u) for u in self.get_queryset().filter(
+            uuid__in=run_uuids).values_list('uuid', flat=True)]
+        timeout = get_wait_timeout(
+            request, default=default_procedure_run_waiter.max_timeout)
+
+        instance = StreamingHttpResponse(
+            self.iterate_events(run_uuids, timeout),
+            content_type='text/event-stream',
+        )
+        instance['Cache-Control'] = 'no-cache'
+        instance['X-Accel-Buffering'] = 'no'
+        return instance
+
+    export_chunk_size = 2000
+    export_fields = [
+        'uuid',
+        'procedure__site__signature',
+        'procedure__signature',
+        'status',
+        'created_time',
+        'finished_time',
+        'outputs',
+    ]
+    export_names = [
+        'uuid',
+        'site',
+        'procedure',
+        'status',
+        'created_time',
+        'finished_time',
+        'outputs',
+    ]
+
+    @staticmethod
+    def format_export_value(value):
+        if isinstance(value, datetime.datetime):
+            return value.isoformat()
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        if isinstance(value, (bytes, memoryview)):
+            return decode_values(value)
+        return value
+
+    def iterate_export_rows(self):
+        # rows are streamed by a server-side cursor, oldest first
+        queryset = self.filter_queryset(self.get_queryset()).order_by(
+            'created_time',
+            'id',
+        ).values_list(*self.export_fields)
+        for row in queryset.iterator(chunk_size=self.export_chunk_size):
+            yield [self.format_export_value(v) for v in row]
+
+    def export_ndjson(self):
+        for row in self.iterate_export_rows():
+            yield json.dumps(dict(zip(self.export_names, row))) + '\n'
+
+    def export_csv(self):
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(self.export_names)
+        for row in self.iterate_export_rows():
+            yield writer.writerow([
+                json.dumps(v) if isinstance(v, list) else v for v in row
+            ])
+
+    @decorators.action(
+        methods=['get'],
+        url_name='export',
+        url_path='export',
+        detail=False,
+    )
+    def export(self, request, *args, **kwargs):
+        output = request.query_params.get('output', 'ndjson')
+        if output == 'ndjson':
+            content, content_type = (
+                self.export_ndjson(), 'application/x-ndjson')
+        elif output == 'csv':
+            content, content_type = (
+                self.export_csv(), 'text/csv')
+        else:
+            raise exceptions.ValidationError('invalid output')
+
+        return StreamingHttpResponse(content, content_type=content_type)
+
+
+class ProcedureRunArchiveViewSet(viewsets.GenericViewSet):
+    """
+    read-only access to runs pruned into archive files
+    """
+    permission_classes = [UserPermission]
+    serializer_class = ProcedureRunArchiveQuerySerializer
+    pagination_class = None
+
+    def iterate_records(self, query):
+        date_after = query.get('date_after')
+        date_before = query.get('date_before')
+        filters = {
+            k: query[k] for k in ['site', 'procedure', 'status'] if k in query
+        }
+
+        for record in default_procedure_run_archive.read(
+                self.request.user.uuid,
+                date_from=date_after and date_after.isoformat(),
+                date_to=date_before and date_before.isoformat(),
+        ):
+            if all(record.get(k) == v for k, v in filters.items()):
+                yield json.dumps(record) + '\n'
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        return StreamingHttpResponse(
+            self.iterate_records(serializer.validated_data),
+            content_type='application/x-ndjson',
+        )
@@ -0,0 +1,87 @@
+import threading
+import time
+
+from django.conf import settings
+
+from .models import ProcedureRun
+
+
+class ProcedureRunWaiter(object):
+    """
+    wait for runs to finish, runs finished in this process wake waiters
+    at once, runs finished by other processes are noticed by polling
+    database every `poll_interval` seconds
+    """
+
+    def __init__(self, poll_interval=1.0, max_timeout=30.0):
+        self.poll_interval = poll_interval
+        self.max_timeout = max_timeout
+        self.events = {}
+        self.lock = threading.Lock()
+
+    def notify(self, run_uuid):
+        with self.lock:
+            events = list(self.events.get(str(run_uuid), []))
+        for e in events:
+            e.set()
+
+    def register(self, run_uuids, event):
+        with self.lock:
+            for run_uuid in run_uuids:
+                self.events.setdefault(run_uuid, set()).add(event)
+
+    def unregister(self, run_uuids, event):
+        with self.lock:
+            for run_uuid in run_uuids:
+                events = self.events.get(run_uuid)
+                if events is None:
+                    continue
+                events.discard(event)
+                if not events:
+                    del self.events[run_uuid]
+
+    def iterate_finished(self, run_uuids, timeout):
+        """
+        yield uuids of runs once they are finished, until all of them are
+        finished or `timeout` seconds (at most `max_timeout`) passed
+        """
+        run_uuids = set(str(u) for u in run_uuids)
+        remaining = set(run_uuids)
+        deadline = time.monotonic() + min(timeout, self.max_timeout)
+        event = threading.Event()
+        self.register(run_uuids, event)
+        try:
+            while remaining:
+                event.clear()
+                finished = set(str(u) for u in ProcedureRun.objects.filter(
+                    uuid__in=remaining,
+                    status='finished',
+                ).values_list('uuid', flat=True))
+                for run_uuid in sorted(finished):
+                    yield run_uuid
+                remaining -= finished
+
+                now = time.monotonic()
+                if not remaining or now >= deadline:
+                    return
+                event.wait(min(self.poll_interval, deadline - now))
+        finally:
+            self.unregister(run_uuids, event)
+
+    def wait(self, run_uuid, timeout):
+        """
+        :return: True if run finished within timeout
+        """
+        return any(self.iterate_finished([run_uuid], timeout))
+
+
+class DefaultProcedureRunWaiter(ProcedureRunWaiter):
+    def __init__(self):
+        config = getattr(settings, 'ABEI_API_RUN_WAIT', {})
+        super().__init__(
+            poll_interval=config.get('POLL_INTERVAL', 1.0),
+            max_timeout=config.get('MAX_TIMEOUT', 30.0),
+        )
+
+
+default_procedure_run_waiter = DefaultProcedureRunWaiter()
@@ -0,0 +1,96 @@
+import logging
+import threading
+
+from django import db
+from django.db import (
+    models,
+    transaction,
+)
+from django.utils import timezone
+
+from .models import ProcedureRun
+from .tasks import (
+    finish_procedure_run,
+    get_run_lease,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def claim_procedure_runs(count):
+    """
+    atomically mark at most `count` runs as running and return their ids,
+    claimable runs are pending ones and running ones whose lease expired
+    """
+    now = timezone.now()
+    lease_time = now + get_run_lease()
+    claimable = (
+        models.Q(status='pending') |
+        models.Q(status='running', lease_time__lt=now)
+    )
+
+    if db.connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            run_ids = list(ProcedureRun.objects.select_for_update(
+                skip_locked=True,
+            ).filter(claimable).order_by('id').values_list(
+                'id', flat=True)[:count])
+
+            ProcedureRun.objects.filter(id__in=run_ids).update(
+                status='running',
+                lease_time=lease_time,
+            )
+        return run_ids
+
+    # without row locks, claim candidates one by one with
+    # compare-and-set updates, runs taken by others are skipped
+    run_ids = []
+    for run_id, status, lease_time_prev in ProcedureRun.objects.filter(
+            claimable,
+    ).order_by('id').values_list('id', 'status', 'lease_time')[:count]:
+        if ProcedureRun.objects.filter(
+                id=run_id,
+                status=status,
+                lease_time=lease_time_prev,
+        ).update(status='running', lease_time=lease_time):
+            run_ids.append(run_id)
+
+    return run_ids
+
+
+class ProcedureRunWorker(object):
+    """
+    worker executing runs claimed from database
+    """
+
+    def __init__(self, batch_size=1, poll_interval=1.0):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+
+    def run_once(self):
+        run_ids = claim_procedure_runs(self.batch_size)
+        for run in ProcedureRun.objects.filter(
+                id__in=run_ids,
+        ).select_related('procedure__site').order_by('id'):
+            try:
+                finish_procedure_run(run)
+            except Exception as e:
+                logger.error(
+                    'failed to execute procedure run %s: %s', run.uuid, e)
+
+        return len(run_ids)
+
+    def run_forever(self, stop_event=None):
+        stop_event = stop_event or threading.Event()
+        try:
+            while not stop_event.is_set():
+                try:
+                    if self.run_once():
+                        continue
+                except db.Error as e:
+                    logger.error('failed to claim procedure runs: %s', e)
+                    db.close_old_connections()
+
+                stop_event.wait(self.poll_interval)
+        finally:
+            db.connections.close_all()
@@ -0,0 +1,268 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from rest_framework import views
+
+from .permissions import AdminPermission
+
+default_buckets = [
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+]
+count_buckets = [
+    0, 1, 2, 5, 10, 20, 50, 100, 200, 500,
+]
+
+
+class MetricRegistry(object):
+    """
+    process-local counters and histograms exported in prometheus text
+    format. with `directory` set, every process dumps its samples to
+    <directory>/<pid>.json at most every `flush_interval` seconds and
+    samples of all processes are summed when exported. samples of label
+    sets beyond the first `max_series` are dropped and counted instead
+    """
+
+    dropped_key = ('metric_samples_dropped_total', ())
+
+    def __init__(self, directory=None, flush_interval=5.0, max_series=1000):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.max_series = max_series
+        self.flushed_time = 0.0
+        self.lock = threading.Lock()
+        self.helps = {}
+        self.types = {}
+        self.buckets = {}
+        self.samples = {}
+        self.collectors = []
+
+    def describe(self, name, kind, text, buckets=None):
+        self.helps[name] = text
+        self.types[name] = kind
+        if buckets:
+            self.buckets[name] = buckets
+
+    def add_collector(self, collector):
+        """
+        :param collector: function returning (name, labels, value) of
+            gauges computed when exported
+        """
+        self.collectors.append(collector)
+
+    def make_key(self, name, labels):
+        """
+        :return: key of samples of labels, None if there are too many
+            label sets already, should be called with lock held
+        """
+        key = (name, tuple(sorted(labels.items())))
+        if key in self.samples or len(self.samples) < self.max_series:
+            return key
+
+        self.samples[self.dropped_key] = self.samples.get(
+            self.dropped_key, 0) + 1
+        return None
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            key = self.make_key(name, labels)
+            if key:
+                self.samples[key] = self.samples.get(key, 0) + value
+        self.flush()
+
+    def observe(self, name, value, **labels):
+        buckets = self.buckets.get(name, default_buckets)
+        with self.lock:
+            key = self.make_key(name, labels)
+            if not key:
+                return
+            sample = self.samples.get(key)
+            if sample is None:
+                sample = self.samples[key] = [0] * (len(buckets) + 2)
+            sample[bisect.bisect_left(buckets, value)] += 1
+            sample[-1] += value
+        self.flush()
+
+    def flush(self, force=False):
+        if not self.directory:
+            return
+
+        now = time.monotonic()
+        if not force and now - self.flushed_time < self.flush_interval:
+            return
+        self.flushed_time = now
+
+        with self.lock:
+            samples = [
+                [name, labels, value]
+                for (name, labels), value in self.samples.items()
+            ]
+
+        path = os.path.join(self.directory, '{}.json'.format(os.getpid()))
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(samples, f)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        if not self.directory:
+            with self.lock:
+                return {
+                    k: list(v) if isinstance(v, list) else v
+                    for k, v in self.samples.items()
+                }
+
+        self.flush(force=True)
+        merged = {}
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as f:
+                    samples = json.load(f)
+            except (OSError, ValueError):
+                continue  # file of a process being replaced
+
+            for name, labels, value in samples:
+                key = (name, tuple(tuple(i) for i in labels))
+                if isinstance(value, list):
+                    prev = merged.get(key) or [0] * len(value)
+                    merged[key] = [a + b for a, b in zip(prev, value)]
+                else:
+                    merged[key] = merged.get(key, 0) + value
+
+        return merged
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ''
+        return '{{{}}}'.format(','.join(
+            '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace(
+                '"', '\\"').replace('\n', '\\n'))
+            for k, v in labels
+        ))
+
+    def render(self):
+        samples = self.collect()
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                samples[(name, tuple(sorted(labels.items())))] = value
+
+        lines = []
+        for name in sorted(set(k[0] for k in samples)):
+            if name in self.helps:
+                lines.append('# HELP {} {}'.format(name, self.helps[name]))
+                lines.append('# TYPE {} {}'.format(name, self.types[name]))
+
+            for (_, labels), value in sorted(
+                    (k, v) for k, v in samples.items() if k[0] == name):
+                if not isinstance(value, list):
+                    lines.append('{}{} {}'.format(
+                        name, self.format_labels(labels), value))
+                    continue
+
+                buckets = self.buckets.get(name, default_buckets)
+                count = 0
+                for bound, hits in zip(
+                        buckets + ['+Inf'], value[:-1]):
+                    count += hits
+                    lines.append('{}_bucket{} {}'.format(
+                        name,
+                        self.format_labels(labels + (('le', bound),)),
+                        count,
+                    ))
+                lines.append('{}_sum{} {}'.format(
+                    name, self.format_labels(labels), value[-1]))
+                lines.append('{}_count{} {}'.format(
+                    name, self.format_labels(labels), count))
+
+        return '\n'.join(lines) + '\n'
+
+
+class DefaultMetricRegistry(MetricRegistry):
+    def __init__(self):
+        config = getattr(settings, 'ABEI_API_METRICS', {})
+        super().__init__(
+            directory=config.get('MULTIPROCESS_DIR'),
+            flush_interval=config.get('FLUSH_INTERVAL', 5.0),
+            max_series=config.get('MAX_SERIES', 1000),
+        )
+
+
+default_metric_registry = DefaultMetricRegistry()
+default_metric_registry.describe(
+    'metric_samples_dropped_total', 'counter',
+    'samples dropped for their metrics had too many label sets',
+)
+default_metric_registry.describe(
+    'http_request_duration_seconds', 'histogram',
+    'latency of requests per view action',
+)
+default_metric_registry.describe(
+    'http_request_queries', 'histogram',
+    'number of database queries per request',
+    buckets=count_buckets,
+)
+
+
+class MetricsMiddleware(object):
+    """
+    observe latency and database queries of every request, labelled by
+    url name and viewset action
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0]
+
+        def count_query(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        if match:
+            view = match.url_name or match.view_name
+            actions = getattr(match.func, 'actions', None) or {}
+            action = actions.get(request.method.lower(), '')
+            default_metric_registry.observe(
+                'http_request_duration_seconds',
+                elapsed,
+                view=view,
+                action=action,
+                method=request.method,
+                status=response.status_code,
+            )
+            default_metric_registry.observe(
+                'http_request_queries',
+                queries[0],
+                view=view,
+                action=action,
+            )
+
+        return response
+
+
+class MetricsView(views.APIView):
+    """
+    metrics of all processes in prometheus text format, for admins only
+    """
+    permission_classes = [AdminPermission]
+
+    def get(self, request):
+        return HttpResponse(
+            default_metric_registry.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
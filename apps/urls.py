@@ -6,8 +6,11 @@ from rest_framework_swagger.views import (
     get_swagger_view
 )
 
+from .metrics import MetricsView
+
 urlpatterns = [
     path('', include('apps.editors.urls')),
     path('', include('apps.executors.urls')),
     path('swagger/', get_swagger_view(title='ABEI API')),
+    path('metrics', MetricsView.as_view()),
 ]
@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+"""
+load test of editors and executors endpoints with synthetic tenants
+
+    # app served in this process, tenants are authenticated by a mocked
+    # oauth2 introspection, data goes to a throwaway test database
+    python scripts/loadtest.py --tenants 10 --concurrency 8 --duration 30
+
+    # app served by a local gunicorn, one tenant per bearer token
+    python scripts/loadtest.py --url http://localhost:8000 --tokens tokens
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+import requests
+
+
+class HttpTransport(object):
+    """
+    send requests to a running server
+    """
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, token, data=None):
+        response = self.session.request(
+            method,
+            '{}/{}'.format(self.url, path),
+            json=data,
+            headers={'Authorization': 'Bearer {}'.format(token)},
+        )
+        return response.status_code
+
+
+class InProcessTransport(object):
+    """
+    send requests to the wsgi app of this process
+    """
+
+    def __init__(self):
+        from django.test import Client
+        self.client = Client()
+
+    def request(self, method, path, token, data=None):
+        try:
+            response = self.client.generic(
+                method,
+                '/{}'.format(path),
+                data=json.dumps(data) if data is not None else '',
+                content_type='application/json',
+                HTTP_AUTHORIZATION='Bearer {}'.format(token),
+            )
+        except Exception:
+            return 500  # raised by views instead of being rendered
+        return response.status_code
+
+
+def mock_authentication(tokens):
+    """
+    answer oauth2 introspection of every tenant token with its own user
+    """
+    import requests_mock
+    from mb_drf_extensions.authentication import OAuth2Mixin
+    from apps.scopes import scope_of_users
+
+    def introspect(request, context):
+        token = urllib.parse.parse_qs(request.text).get('token', [''])[0]
+        return json.dumps({
+            'scope': scope_of_users,
+            'user': {
+                'username': token,
+                'uuid': tokens.get(token),
+            },
+        })
+
+    mocker = requests_mock.Mocker(real_http=False)
+    mocker.register_uri(
+        'POST', OAuth2Mixin.oauth2_login_url,
+        text=json.dumps({
+            'access_token': uuid.uuid4().hex,
+            'expires_in': 36000,
+        }),
+    )
+    mocker.register_uri(
+        'POST', OAuth2Mixin.oauth2_introspect_url,
+        text=introspect,
+    )
+    return mocker
+
+
+class Recorder(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, endpoint, elapsed, status_code):
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append(
+                (elapsed, status_code >= 400))
+
+    @staticmethod
+    def percentile(values, p):
+        return values[min(len(values) - 1, int(len(values) * p))]
+
+    def report(self, duration):
+        report = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = sorted(s[0] for s in samples)
+            errors = sum(1 for s in samples if s[1])
+            report[endpoint] = {
+                'count': len(samples),
+                'throughput': len(samples) / duration,
+                'error_rate': errors / len(samples),
+                'p50': self.percentile(latencies, 0.50),
+                'p95': self.percentile(latencies, 0.95),
+                'p99': self.percentile(latencies, 0.99),
+            }
+        return report
+
+
+class Tenant(object):
+    site = 'loadtest'
+    procedure = 'loadtest-procedure'
+
+    def __init__(self, token):
+        self.token = token
+
+    @property
+    def procedure_path(self):
+        return 'sites/{}/procedures/{}/'.format(self.site, self.procedure)
+
+    def setup(self, transport, recorder):
+        """
+        build procedure out = (x + y) * y through editors api
+        """
+        procedure_path = self.procedure_path
+        joints_path = procedure_path + 'joints/'
+        steps = [
+            ('init sites', 'POST', 'sites/init/', None),
+            ('create site', 'POST', 'sites/', {
+                'signature': self.site,
+            }),
+            ('create base site', 'POST', 'sites/{}/base-sites/'.format(
+                self.site), {
+                'signature': 'builtin',
+            }),
+            ('create procedure', 'POST', 'sites/{}/procedures/'.format(
+                self.site), {
+                'signature': self.procedure,
+            }),
+            ('create input', 'POST', procedure_path + 'inputs/', {
+                'signature': 'float', 'index': 0,
+            }),
+            ('create input', 'POST', procedure_path + 'inputs/', {
+                'signature': 'float', 'index': 1,
+            }),
+            ('create output', 'POST', procedure_path + 'outputs/', {
+                'signature': 'float', 'index': 0,
+            }),
+            ('create joint', 'POST', joints_path, {
+                'signature': 'add',
+                'site': 'builtin',
+                'procedure': 'float-add',
+            }),
+            ('create joint', 'POST', joints_path, {
+                'signature': 'mul',
+                'site': 'builtin',
+                'procedure': 'float-mul',
+            }),
+            ('create link', 'POST', joints_path + 'add/links/', {
+                'index': 0, 'input_index': 0,
+            }),
+            ('create link', 'POST', joints_path + 'add/links/', {
+                'index': 1, 'input_index': 1,
+            }),
+            ('create link', 'POST', joints_path + 'mul/links/', {
+                'index': 0, 'input_joint': 'add', 'input_index': 0,
+            }),
+            ('create link', 'POST', joints_path + 'mul/links/', {
+                'index': 1, 'input_index': 1,
+            }),
+            ('update output link', 'PUT', procedure_path + 'outputs/0/link/', {
+                'output_joint': 'mul', 'output_index': 0,
+            }),
+        ]
+        for endpoint, method, path, data in steps:
+            start = time.perf_counter()
+            status_code = transport.request(method, path, self.token, data)
+            recorder.record(
+                'setup: ' + endpoint, time.perf_counter() - start, status_code)
+
+    def make_request(self, kind, rand):
+        procedure_path = self.procedure_path
+        if kind == 'read':
+            return rand.choice([
+                ('GET procedure', 'GET', procedure_path, None),
+                ('GET joints', 'GET', procedure_path + 'joints/', None),
+                ('GET run-logs', 'GET', 'run-logs/?limit=20', None),
+            ])
+        if kind == 'edit':
+            return ('PATCH procedure', 'PATCH', procedure_path, {
+                'docstring': uuid.uuid4().hex,
+            })
+        return ('POST run', 'POST', procedure_path + 'runs/', {
+            'inputs': [rand.uniform(-10, 10), rand.uniform(-10, 10)],
+        })
+
+
+def run_worker(
+        transport,
+        tenants,
+        recorder,
+        mix,
+        deadline,
+        seed,
+):
+    rand = random.Random(seed)
+    kinds = [k for k, w in mix.items() for _ in range(w)]
+    while time.monotonic() < deadline:
+        tenant = rand.choice(tenants)
+        endpoint, method, path, data = tenant.make_request(
+            rand.choice(kinds), rand)
+        start = time.perf_counter()
+        status_code = transport.request(method, path, tenant.token, data)
+        recorder.record(endpoint, time.perf_counter() - start, status_code)
+
+
+def parse_mix(text):
+    mix = dict(
+        (k, int(w)) for k, w in (i.split(':') for i in text.split(','))
+    )
+    if set(mix) - {'read', 'edit', 'run'} or sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError('invalid mix {}'.format(text))
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--url',
+        help='base url of running server, app is served in-process if not '
+             'given',
+    )
+    parser.add_argument(
+        '--tokens',
+        help='file of bearer tokens of tenants, one per line, used with '
+             '--url',
+    )
+    parser.add_argument('--tenants', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument(
+        '--duration', type=float, default=30.0, help='seconds of traffic')
+    parser.add_argument(
+        '--mix',
+        type=parse_mix,
+        default='read:6,edit:1,run:3',
+        help='weights of read, edit and run requests',
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to write json report to')
+    args = parser.parse_args()
+
+    if args.url:
+        if not args.tokens:
+            parser.error('--tokens is required with --url')
+        with open(args.tokens) as f:
+            tokens = [t.strip() for t in f if t.strip()]
+        tenants = [Tenant(t) for t in tokens]
+
+        def create_transport():
+            return HttpTransport(args.url)
+
+        mocker = None
+        teardown = None
+
+    else:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        sys.path.insert(0, root)
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings.configs')
+
+        import django
+        django.setup()
+
+        from django.db import connection
+        from django.test.utils import (
+            setup_test_environment,
+            teardown_test_environment,
+        )
+
+        setup_test_environment()
+        database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0)
+
+        def teardown():
+            connection.creation.destroy_test_db(database_name, verbosity=0)
+            teardown_test_environment()
+
+        tokens = {
+            uuid.uuid4().hex: str(uuid.uuid4()) for _ in range(args.tenants)
+        }
+        tenants = [Tenant(t) for t in tokens]
+        create_transport = InProcessTransport
+        mocker = mock_authentication(tokens)
+        mocker.start()
+
+    recorder = Recorder()
+    try:
+        transport = create_transport()
+        for tenant in tenants:
+            tenant.setup(transport, recorder)
+
+        deadline = time.monotonic() + args.duration
+        threads = [
+            threading.Thread(
+                target=run_worker,
+                args=(
+                    create_transport(),
+                    tenants,
+                    recorder,
+                    args.mix,
+                    deadline,
+                    args.seed + i,
+                ),
+            ) for i in range(args.concurrency)
+        ]
+        start = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        duration = time.monotonic() - start
+
+    finally:
+        if mocker:
+            mocker.stop()
+        if teardown:
+            teardown()
+
+    report = recorder.report(duration)
+    print('{:<32} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}'.format(
+        'endpoint', 'count', 'req/s', 'errors', 'p50 ms', 'p95 ms', 'p99 ms'))
+    row = '{:<32} {:>8} {:>8.1f} {:>7.1%} {:>8.1f} {:>8.1f} {:>8.1f}'
+    for endpoint, r in report.items():
+        print(row.format(
+            endpoint,
+            r['count'],
+            r['throughput'],
+            r['error_rate'],
+            r['p50'] * 1000,
+            r['p95'] * 1000,
+            r['p99'] * 1000,
+        ))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'config': {
+                    'url': args.url,
+                    'tenants': len(tenants),
+                    'concurrency': args.concurrency,
+                    'duration': duration,
+                    'mix': args.mix,
+                    'seed': args.seed,
+                },
+                'endpoints': report,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
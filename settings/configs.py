@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'apps.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -138,3 +139,69 @@ SWAGGER_SETTINGS = {
     'USE_SESSION_AUTH': False,
     'SECURITY_DEFINITIONS': {},
 }
+
+# ABEI API
+ABEI_API_RUN_DISPATCHER = {
+    # thread, process, inline or database
+    'MODE': 'thread',
+    'MAX_WORKERS': 4,
+}
+
+# signatures of builtin procedures whose outputs are not determined by
+# their inputs, they are neither merged nor memoized
+ABEI_API_IMPURE_PROCEDURES = []
+
+# composite procedures whose plans have at most this many steps are
+# inlined into plans of procedures using them, larger ones are called
+ABEI_API_PLAN_INLINE_STEPS = 64
+
+ABEI_API_RUN_BATCH = {
+    # max number of input vectors of a batch run
+    'MAX_SIZE': 10000,
+    # scalar, or numpy (requires numpy) to evaluate float-only
+    # procedures over whole columns of input vectors
+    'ENGINE': 'scalar',
+}
+
+ABEI_API_RUN_CACHE = {
+    # memoize outputs of deterministic runs
+    'ENABLED': False,
+    'MAX_SIZE': 4096,
+    # name of abei IStorage service sharing results between processes
+    'STORAGE': None,
+}
+
+ABEI_API_RUN_WORKERS = {
+    'CONCURRENCY': 1,
+    'BATCH_SIZE': 1,
+    'POLL_INTERVAL': 1.0,
+    # seconds before a running run is claimed again
+    'LEASE': 600,
+}
+
+ABEI_API_RUN_WAIT = {
+    # longest wait of long polls and event streams in seconds
+    'MAX_TIMEOUT': 30.0,
+    # seconds between checks for runs finished by other processes
+    'POLL_INTERVAL': 1.0,
+}
+
+ABEI_API_RUN_RETENTION = {
+    # days finished runs are kept by prune_runs, None keeps them forever
+    'DAYS': None,
+    'BATCH_SIZE': 1000,
+    # archive pruned runs as compressed ndjson files before deletion
+    'ARCHIVE': True,
+    'ARCHIVE_DIR': os.path.join(BASE_DIR, 'archives'),
+}
+
+ABEI_API_METRICS = {
+    # directory shared by worker processes (e.g. gunicorn workers), each
+    # process dumps its samples there and /metrics sums them, it should
+    # be emptied before server starts. None keeps samples process-local
+    'MULTIPROCESS_DIR': None,
+    # seconds between dumps of samples of a process
+    'FLUSH_INTERVAL': 5.0,
+    # label sets kept per process, samples of further ones are dropped
+    'MAX_SERIES': 1000,
+}